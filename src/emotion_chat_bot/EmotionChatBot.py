@@ -1,27 +1,40 @@
-from typing import Any, Dict, List, Optional, Union
+import copy
+import logging
+import queue
+import random
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+from typing import Any, Callable, Dict, Iterator, List, Literal, Optional, Union
 
 import torch
 from torch import Tensor
-from transformers import (
-	AutoModelForSequenceClassification,
-	AutoTokenizer,
-	BitsAndBytesConfig,
-	GenerationConfig,
-	TextClassificationPipeline,
-)
-from unsloth import FastLanguageModel
+from transformers import GenerationConfig, TextClassificationPipeline, TextIteratorStreamer
 
+from emotion_chat_bot.model.emotion_model.EmotionModelKernel import EmotionModelKernel
+from emotion_chat_bot.model.emotion_model.EmotionTrajectoryPlanner import EmotionTrajectoryPlanner
 from emotion_chat_bot.model.emotion_model.EmotionTransition import (
 	EmotionModel,
 	SimilarityAnalyzer,
 	generate_representation,
-	get_emotion_composition,
+	get_emotion_compositions,
 )
+from emotion_chat_bot.model.emotion_model.EmotionTransitionTable import EmotionTransitionTable
 from emotion_chat_bot.pipeline.ResponseGenerationPipeline import ResponseGeneratorPipeline
+from emotion_chat_bot.session.ChatHistory import ChatHistory, Turn
+from emotion_chat_bot.session.ChatSession import ChatSession
+from emotion_chat_bot.session.SessionStore import InMemorySessionStore, SessionStore
+from emotion_chat_bot.session.Summarizer import Summarizer
+from emotion_chat_bot.utils.CompositionCache import EmotionCompositionCache
+from emotion_chat_bot.utils.ModelLoader import check_backend, load_response_generator, load_text_classifier
+from emotion_chat_bot.utils.RetryPolicy import RetryPolicy
+
+logger: logging.Logger = logging.getLogger(__name__)
 
-roles: List[str] = ["user", "bot"]
 emotions: List[str] = ["neutral", "anger", "disgust", "fear", "happiness", "sadness", "surprise"]
 
+streamer_poll_interval: float = 1.0
+
 default_generation_config = GenerationConfig(
 	max_new_tokens=20, min_new_tokens=5, repetition_penalty=1.5, pad_token_id=32000, eos_token_id=2
 )
@@ -38,170 +51,736 @@ class EmotionChatBot:
 		emotion_tendency: Optional[Union[Dict[str, float], int]] = None,
 		system_prompt: Optional[str] = "",
 		max_num_turns: Optional[int] = 5,
+		prefix_caching: bool = False,
+		response_selection: Literal["regenerate", "candidate"] = "regenerate",
+		selection_audit_rate: float = 0.0,
+		retry_policy: Optional[RetryPolicy] = None,
+		lazy_loading: bool = False,
+		backend: Literal["cuda", "cpu"] = "cuda",
+		cpu_precision: Literal["fp32", "bf16", "int8"] = "int8",
+		classification_cache: Optional[EmotionCompositionCache] = None,
+		incremental_tokenization: bool = False,
+		num_sequences_per_candidate: int = 1,
+		session_store: Optional[SessionStore] = None,
+		max_context_tokens: Optional[int] = None,
+		summarizer: Optional[Summarizer] = None,
+		summary_interval: int = 4,
+		lookahead_top_k: Optional[int] = None,
+		lookahead_horizon: int = 1,
+		transition_table_model_name: Optional[str] = None,
+		predictor_refinement_weight: float = 0.5,
+		predictor_skip_queue_depth: Optional[int] = None,
+		emotion_model_backend: Literal["torch", "numpy"] = "torch",
 	) -> None:
-		model, tokenizer = FastLanguageModel.from_pretrained(
-			model_name=response_generator_model_name,
-			attn_implementation="flash_attention_2",
-			pretraining_tp=1,
-			load_in_4bit=True,
-			device_map="auto",
-			low_cpu_mem_usage=True,
-			trust_remote_code=True,
-		)
-		tokenizer.padding_side = "left"
-		tokenizer.clean_up_tokenization_spaces = True
-		FastLanguageModel.for_inference(model)
-
-		self.response_generator = ResponseGeneratorPipeline(
-			model,
-			tokenizer,
-			framework="pt",
-			task="conversation-generation",
-			num_workers=16,
-			torch_dtype="auto",
-			add_special_tokens=True,
-			truncation=False,
-			padding=True,
-		)
+		check_backend(backend, cpu_precision)
+		if response_selection not in ["regenerate", "candidate"]:
+			raise ValueError("response_selection must be either 'regenerate' or 'candidate'")
+		if not (0 <= selection_audit_rate <= 1):
+			raise ValueError("selection_audit_rate must between 0 and 1 (inclusive)")
+		if num_sequences_per_candidate < 1:
+			raise ValueError("num_sequences_per_candidate must be at least 1")
+		if max_context_tokens is not None and max_context_tokens < 1:
+			raise ValueError("max_context_tokens must be at least 1")
+		if summary_interval < 1:
+			raise ValueError("summary_interval must be at least 1")
+		if emotion_model_backend not in ["torch", "numpy"]:
+			raise ValueError("emotion_model_backend must be either 'torch' or 'numpy'")
+		if not (0 <= predictor_refinement_weight <= 1):
+			raise ValueError("predictor_refinement_weight must between 0 and 1 (inclusive)")
+		if predictor_skip_queue_depth is not None and predictor_skip_queue_depth < 0:
+			raise ValueError("predictor_skip_queue_depth must not be negative")
 
-		sentiment_analysis_model = AutoModelForSequenceClassification.from_pretrained(
-			sentiment_analyzer_model_name,
-			quantization_config=BitsAndBytesConfig(load_in_4bit=True, bnb_4bit_compute_dtype=torch.float16),
-			device_map="auto",
-			low_cpu_mem_usage=True,
+		self.similarity_analyzer = SimilarityAnalyzer(
+			generate_representation(emotion_tendency), threshold=similarity_threshold
 		)
+		self.planner: Optional[EmotionTrajectoryPlanner] = None
+		if lookahead_top_k is not None:
+			self.planner = EmotionTrajectoryPlanner(
+				self.similarity_analyzer,
+				horizon=lookahead_horizon,
+				top_k=lookahead_top_k,
+				reaction_model=(
+					(lambda compositions: self.transition_table(compositions))
+					if transition_table_model_name is not None
+					else None
+				),
+			)
+		self.use_transition_table: bool = transition_table_model_name is not None
+		self.predictor_refinement_weight: float = predictor_refinement_weight
+		self.predictor_skip_queue_depth: Optional[int] = predictor_skip_queue_depth
 
-		sentiment_analysis_tokenizer = AutoTokenizer.from_pretrained(
-			sentiment_analyzer_model_name, trust_remote_code=True
+		self.system_prompt: Dict[str, Any] = {"role": "system", "content": {"emotion": "", "dialog": system_prompt}}
+		self.max_num_messages: Optional[int] = max_num_turns * 2 if max_num_turns is not None else None
+		self.max_context_tokens: Optional[int] = max_context_tokens
+		self.__max_generation_prompt_length: Optional[int] = None
+		self.summarizer: Optional[Summarizer] = summarizer
+		self.summary_interval: int = summary_interval
+		self.__summary_executor: Optional[ThreadPoolExecutor] = (
+			ThreadPoolExecutor(max_workers=1) if summarizer is not None else None
 		)
+		self.prefix_caching: bool = prefix_caching
+		self.incremental_tokenization: bool = incremental_tokenization
+		self.num_sequences_per_candidate: int = num_sequences_per_candidate
+		self.response_selection: str = response_selection
+		self.selection_audit_rate: float = selection_audit_rate
+		self.selection_statistics: Dict[str, int] = {"num_audited": 0, "num_disagreed": 0}
+		self.retry_policy: RetryPolicy = retry_policy if retry_policy is not None else RetryPolicy()
+		self.session_store: SessionStore = session_store if session_store is not None else InMemorySessionStore()
+		self.classification_cache: Optional[EmotionCompositionCache] = classification_cache
+
+		self.__component_model_names: Dict[str, str] = {
+			"sentiment_analyzer": sentiment_analyzer_model_name,
+			"emotion_predictor": emotion_predictor_model_name,
+		}
+		self.__component_loaders: Dict[str, Callable[[], Any]] = {
+			"response_generator": lambda: load_response_generator(
+				response_generator_model_name, backend, cpu_precision
+			),
+			"sentiment_analyzer": lambda: load_text_classifier(sentiment_analyzer_model_name, backend, cpu_precision),
+			"emotion_predictor": lambda: load_text_classifier(emotion_predictor_model_name, backend, cpu_precision),
+			"emotion_model": lambda: (
+				EmotionModelKernel.from_emotion_model(EmotionModel.from_pretrained(emotion_model_model_name))
+				if emotion_model_backend == "numpy"
+				else EmotionModel.from_pretrained(emotion_model_model_name).eval()
+			),
+		}
+		if transition_table_model_name is not None:
+			self.__component_loaders["transition_table"] = lambda: EmotionTransitionTable.from_pretrained(
+				transition_table_model_name
+			).eval()
+		self.__component_locks: Dict[str, Lock] = {name: Lock() for name in self.__component_loaders.keys()}
+		self.__components: Dict[str, Any] = {}
+		self.load_time_report: Dict[str, float] = {}
+
+		if not lazy_loading:
+			self.load_components()
+
+	def __get_component(self, name: str) -> Any:
+		if name not in self.__components:
+			with self.__component_locks[name]:
+				if name not in self.__components:
+					start_time: float = time.perf_counter()
+					self.__components[name] = self.__component_loaders[name]()
+					self.load_time_report[name] = time.perf_counter() - start_time
+
+		return self.__components[name]
+
+	def load_components(self, max_workers: int = 4) -> None:
+		with ThreadPoolExecutor(max_workers=max_workers) as executor:
+			for future in [executor.submit(self.__get_component, name) for name in self.__component_loaders.keys()]:
+				future.result()
+
+	@property
+	def response_generator(self) -> ResponseGeneratorPipeline:
+		return self.__get_component("response_generator")
+
+	@property
+	def sentiment_analyzer(self) -> TextClassificationPipeline:
+		return self.__get_component("sentiment_analyzer")
+
+	@property
+	def emotion_predictor(self) -> TextClassificationPipeline:
+		return self.__get_component("emotion_predictor")
+
+	@property
+	def emotion_model(self) -> Union[EmotionModel, EmotionModelKernel]:
+		return self.__get_component("emotion_model")
+
+	@property
+	def transition_table(self) -> EmotionTransitionTable:
+		return self.__get_component("transition_table")
+
+	def __get_session(self, session_id: str) -> ChatSession:
+		session: Optional[ChatSession] = self.session_store.get(session_id)
+		if session is None:
+			session = ChatSession(history=ChatHistory(self.max_num_messages))
+			self.session_store.put(session_id, session)
+
+		return session
 
-		self.sentiment_analyzer = TextClassificationPipeline(
-			model=sentiment_analysis_model,
-			tokenizer=sentiment_analysis_tokenizer,
-			framework="pt",
-			task="sentiment-analysis",
-			num_workers=12,
-			torch_dtype="auto",
-		)
+	@staticmethod
+	def __form_message(role: str, emotion: Optional[str] = "", dialog: Optional[str] = "") -> Dict[str, Any]:
+		return {"role": role, "content": {"emotion": emotion, "dialog": dialog}}
 
-		emotion_predictor_model = AutoModelForSequenceClassification.from_pretrained(
-			emotion_predictor_model_name,
-			quantization_config=BitsAndBytesConfig(load_in_4bit=True, bnb_4bit_compute_dtype=torch.float16),
-			device_map="auto",
-			low_cpu_mem_usage=True,
-		)
+	def __append_message(self, session: ChatSession, role: str, emotion: str, dialog: Optional[str] = "") -> None:
+		if self.summarizer is not None:
+			self.__apply_summary(session)
+
+		if session.history.is_full:
+			self.__drop_oldest_pair(session)
+
+		session.history.append(Turn.from_message(role, emotion, dialog))
+		if self.__caches_turn_token_ids():
+			self.__tokenize_turns(session)
+		if self.max_context_tokens is not None:
+			self.__fit_context_window(session)
 
-		emotion_predictor_tokenizer = AutoTokenizer.from_pretrained(
-			emotion_predictor_model_name, trust_remote_code=True
+		if self.summarizer is not None:
+			session.num_turns_since_summary += 1
+			self.__schedule_summary(session)
+
+	@staticmethod
+	def __discard_user_turns(sessions: List[ChatSession]) -> None:
+		# a turn that failed before the bot replied must not leave its user message behind
+		for session in sessions:
+			if len(session.history) != 0 and session.history[-1].role == "user":
+				session.history.drop_latest()
+
+	def __drop_oldest_pair(self, session: ChatSession) -> None:
+		evicted_turns: List[Turn] = session.history.drop_oldest(2)
+		if self.summarizer is not None:
+			session.evicted_turns.extend(evicted_turns)
+
+		if len(session.history) != 0:
+			# the system prompt is rendered into the first remaining message
+			session.history[0].token_ids = None
+			if self.__caches_turn_token_ids():
+				self.__tokenize_turns(session)
+
+	def __caches_turn_token_ids(self) -> bool:
+		if not self.incremental_tokenization and self.max_context_tokens is None:
+			return False
+
+		return self.response_generator.supports_incremental_tokenization
+
+	def __get_max_generation_prompt_length(self) -> int:
+		if self.__max_generation_prompt_length is None:
+			try:
+				self.__max_generation_prompt_length = max(
+					len(self.response_generator.generation_prompt_ids(emotion)) for emotion in emotions
+				)
+			except ValueError:
+				# a template that cannot render the header on its own is measured after a short chat instead
+				messages: list = [self.system_prompt, self.__form_message("user", "neutral", "Hi.")]
+				num_tokens: int = len(self.response_generator.tokenize_chat(messages))
+				self.__max_generation_prompt_length = max(
+					len(self.response_generator.tokenize_chat(messages + [self.__form_message("bot", emotion)], True))
+					- num_tokens
+					for emotion in emotions
+				)
+
+		return self.__max_generation_prompt_length
+
+	def __count_prompt_tokens(self, session: ChatSession) -> int:
+		# one render per evaluation, the longest bot header is added instead of rendering it for every emotion
+		return (
+			len(self.response_generator.tokenize_chat(self.__get_messages(session)))
+			+ self.__get_max_generation_prompt_length()
 		)
 
-		self.emotion_predictor = TextClassificationPipeline(
-			model=emotion_predictor_model,
-			tokenizer=emotion_predictor_tokenizer,
-			framework="pt",
-			task="sentiment-analysis",
-			num_workers=12,
-			torch_dtype="auto",
+	def __fit_context_window(self, session: ChatSession) -> None:
+		if not self.response_generator.supports_incremental_tokenization:
+			# per turn counts would not add up to the prompt length, so the whole prompt is measured instead
+			while len(session.history) > 2 and self.__count_prompt_tokens(session) > self.max_context_tokens:
+				self.__drop_oldest_pair(session)
+			return
+
+		# the latest message is always kept even if it alone exceeds the budget
+		history: ChatHistory = session.history
+		budget: int = self.max_context_tokens - self.__get_max_generation_prompt_length()
+		num_tokens: int = sum(turn.num_tokens for turn in history)
+		while num_tokens > budget and len(history) > 2:
+			num_tokens -= history[0].num_tokens + history[1].num_tokens + history[2].num_tokens
+			self.__drop_oldest_pair(session)
+			num_tokens += history[0].num_tokens
+
+	def __schedule_summary(self, session: ChatSession) -> None:
+		if session.summary_future is not None or len(session.evicted_turns) == 0:
+			return
+		if session.num_turns_since_summary < self.summary_interval:
+			return
+
+		# the summary is computed off the request path and applied at the start of a later turn
+		session.summarizing_turns, session.evicted_turns = session.evicted_turns, []
+		session.num_turns_since_summary = 0
+		session.summary_future = self.__summary_executor.submit(
+			self.summarizer, session.summary, session.summarizing_turns
 		)
 
-		self.emotion_model = EmotionModel.from_pretrained(emotion_model_model_name)
+	def __apply_summary(self, session: ChatSession) -> None:
+		if session.summary_future is None or not session.summary_future.done():
+			return
+
+		future: Future = session.summary_future
+		session.summary_future = None
+		if future.exception() is not None:
+			# the turns are kept for the next attempt instead of being lost
+			logger.error("summarizer failed", exc_info=future.exception())
+			session.evicted_turns = session.summarizing_turns + session.evicted_turns
+			session.summarizing_turns = []
+			return
+
+		session.summarizing_turns = []
+		if future.result() == session.summary:
+			return
+
+		session.summary = future.result()
+		session.system_message = None
+		if len(session.history) != 0:
+			session.history[0].token_ids = None
+
+	def __get_system_message(self, session: ChatSession) -> Dict[str, Any]:
+		if session.summary == "":
+			return self.system_prompt
+
+		if session.system_message is None:
+			system_prompt: str = self.system_prompt["content"]["dialog"] or ""
+			session.system_message = self.__form_message(
+				"system", dialog=f"{system_prompt}\nSummary of the earlier conversation: {session.summary}".strip()
+			)
 
-		self.similarity_analyzer = SimilarityAnalyzer(
-			generate_representation(emotion_tendency), threshold=similarity_threshold
-		)
+		return session.system_message
 
-		self.system_prompt: Dict[str, Any] = {"role": "system", "content": {"emotion": "", "dialog": system_prompt}}
-		self.max_num_messages: int = max_num_turns * 2
-		self.messages: List[Dict[str, Any]] = []
-		self.emotion_representation: Tensor = generate_representation(None)
+	def __get_messages(self, session: ChatSession) -> List[Dict[str, Any]]:
+		return session.history.messages(self.__get_system_message(session))
 
-	@staticmethod
-	def __form_message(role: str, emotion: Optional[str] = "", dialog: Optional[str] = "") -> Dict[str, Any]:
-		return {"role": role, "content": {"emotion": emotion, "dialog": dialog}}
+	def __tokenize_turns(self, session: ChatSession) -> None:
+		for i, turn in enumerate(session.history):
+			if turn.token_ids is None:
+				turn.token_ids = self.response_generator.tokenize_message(
+					turn.message, self.__get_system_message(session) if i == 0 else None
+				)
 
-	def __append_message(self, emotion: str, dialog: Optional[str] = "") -> None:
-		next_role: str = roles[len(self.messages) % 2]
+	def __get_prompt_ids(self, session: ChatSession, emotion: str) -> List[int]:
+		if not self.response_generator.supports_incremental_tokenization:
+			return self.response_generator.tokenize_chat(
+				self.__get_messages(session) + [self.__form_message("bot", emotion)], add_generation_prompt=True
+			)
 
-		self.messages.append(self.__form_message(next_role, emotion, dialog))
+		self.__tokenize_turns(session)
+		prompt_ids: List[int] = [token_id for turn in session.history for token_id in turn.token_ids]
 
-		if len(self.messages) > self.max_num_messages:
-			self.messages = self.messages[2:]
+		return prompt_ids + self.response_generator.generation_prompt_ids(emotion)
 
-	def __get_messages(self) -> List[Dict[str, Any]]:
-		return [self.system_prompt] + self.messages
+	def __classify_emotion(self, component: str, texts: List[str]) -> Tensor:
+		def classify(unseen_texts: List[str]) -> Tensor:
+			return get_emotion_compositions(
+				self.__get_component(component)(unseen_texts, return_all_scores=True, batch_size=len(unseen_texts))
+			)
 
-	def __process_user_emotion(self, message: str) -> (Tensor, str):
-		sentiment_analysis_result: list = self.sentiment_analyzer(message, return_all_scores=True)
+		if self.classification_cache is None:
+			return classify(texts)
 
-		user_emotion_composition: Tensor = get_emotion_composition(sentiment_analysis_result[0])
-		user_emotion: str = emotions[user_emotion_composition.argmax()]
+		return self.classification_cache.classify(self.__component_model_names[component], texts, classify)
 
-		return user_emotion_composition, user_emotion
+	def __process_user_emotion(self, messages: List[str]) -> (Tensor, List[str]):
+		user_emotion_compositions: Tensor = self.__classify_emotion("sentiment_analyzer", messages)
+		user_emotions: List[str] = [emotions[index] for index in user_emotion_compositions.argmax(-1).tolist()]
 
-	def __create_candidate_chats(self) -> List[List[Dict[str, Any]]]:
-		messages: list = self.__get_messages()
-		candidates_chats: list = [
-			messages + [{"role": "bot", "content": {"emotion": emotion, "dialog": ""}}] for emotion in emotions
-		]
+		return user_emotion_compositions, user_emotions
+
+	def __create_candidate_chats(
+		self, session: ChatSession, candidate_emotions: List[str]
+	) -> List[List[Dict[str, Any]]]:
+		messages: list = self.__get_messages(session)
+		candidates_chats: list = [messages + [self.__form_message("bot", emotion)] for emotion in candidate_emotions]
 
 		return candidates_chats
 
-	def __generate_candidate_responses(self, generation_config) -> Dict[str, str]:
-		candidates_chats: list = self.__create_candidate_chats()
-		candidates_chats = [
-			chat[0] for chat in self.response_generator(candidates_chats, generation_config=generation_config)
+	def __generate_candidate_responses(
+		self, sessions: List[ChatSession], candidates_emotions: List[List[str]], generation_config
+	) -> List[Dict[str, str]]:
+		num_sequences: int = self.num_sequences_per_candidate
+		if num_sequences > 1:
+			generation_config = copy.deepcopy(generation_config)
+			generation_config.do_sample = True
+		# the shared prefix cache is built per prompt, so those paths repeat the prompts instead
+		multi_sequence_generation_config: GenerationConfig = copy.deepcopy(generation_config)
+		multi_sequence_generation_config.num_return_sequences = num_sequences
+
+		if self.incremental_tokenization:
+			candidates_ids: list = [
+				[self.__get_prompt_ids(session, emotion) for emotion in candidate_emotions]
+				for session, candidate_emotions in zip(sessions, candidates_emotions)
+			]
+			if self.prefix_caching:
+				candidates_responses: list = [
+					response
+					for responses in self.response_generator.generate_from_shared_prefix_ids(
+						[
+							[prompt_ids for prompt_ids in session_candidates_ids for _ in range(num_sequences)]
+							for session_candidates_ids in candidates_ids
+						],
+						generation_config,
+					)
+					for response in responses
+				]
+			else:
+				candidates_responses: list = self.response_generator.generate_from_ids(
+					[prompt_ids for session_candidates_ids in candidates_ids for prompt_ids in session_candidates_ids],
+					multi_sequence_generation_config,
+				)
+			candidates_responses = [response.strip() for response in candidates_responses]
+		elif self.prefix_caching:
+			candidates_responses: list = [
+				response.strip()
+				for responses in self.response_generator.generate_from_shared_prefix(
+					[self.__get_messages(session) for session in sessions],
+					[
+						[
+							self.__form_message("bot", emotion)
+							for emotion in candidate_emotions
+							for _ in range(num_sequences)
+						]
+						for candidate_emotions in candidates_emotions
+					],
+					generation_config,
+				)
+				for response in responses
+			]
+		else:
+			candidates_chats: list = [
+				chat
+				for session, candidate_emotions in zip(sessions, candidates_emotions)
+				for chat in self.__create_candidate_chats(session, candidate_emotions)
+			]
+			candidates_responses: list = [
+				record["generated_text"][-1]["content"]["dialog"].strip()
+				for records in self.response_generator(
+					candidates_chats,
+					generation_config=multi_sequence_generation_config,
+					batch_size=len(candidates_chats),
+					decode_new_tokens_only=True,
+				)
+				for record in records
+			]
+
+		candidates_responses = [
+			self.__pick_response(candidates_responses[i : i + num_sequences])
+			for i in range(0, len(candidates_responses), num_sequences)
 		]
 
-		candidates_responses: list = [chat[-1]["content"]["dialog"].strip() for chat in candidates_chats]
-
-		return dict(zip(emotions, candidates_responses))
+		sessions_candidates_responses: List[Dict[str, str]] = []
+		for candidate_emotions in candidates_emotions:
+			sessions_candidates_responses.append(dict(zip(candidate_emotions, candidates_responses)))
+			candidates_responses = candidates_responses[len(candidate_emotions) :]
+
+		return sessions_candidates_responses
+
+	def __pick_response(self, responses: List[str]) -> str:
+		return next(filter(self.__validate_response, responses), responses[0])
+
+	def __generate_valid_candidate_responses(
+		self, sessions: List[ChatSession], candidates_emotions: List[List[str]], generation_config: GenerationConfig
+	) -> List[Dict[str, str]]:
+		start_time: float = time.monotonic()
+		candidates_responses: List[Dict[str, str]] = [{} for _ in sessions]
+		latest_candidates_responses: List[Dict[str, str]] = [{} for _ in sessions]
+		pending_indices: List[int] = list(range(len(sessions)))
+		num_attempts: int = 0
+		while len(pending_indices) != 0 and not self.retry_policy.is_exhausted(num_attempts, start_time):
+			generated_responses: list = self.__generate_candidate_responses(
+				[sessions[i] for i in pending_indices],
+				[
+					[emotion for emotion in candidates_emotions[i] if emotion not in candidates_responses[i]]
+					for i in pending_indices
+				],
+				self.retry_policy.escalate(generation_config, num_attempts),
+			)
+			num_attempts += 1
+			for i, responses in zip(pending_indices, generated_responses):
+				sessions[i].turn_metrics["num_attempts"] = num_attempts
+				latest_candidates_responses[i].update(responses)
+				candidates_responses[i].update(
+					filter(lambda item: self.__validate_response(item[1]), responses.items())
+				)
+			pending_indices = [
+				i
+				for i in pending_indices
+				if len(candidates_responses[i].keys())
+				< min(self.retry_policy.min_valid_candidates, len(candidates_emotions[i]))
+			]
+
+		for i in pending_indices:
+			sessions[i].turn_metrics["retry_exhausted"] = True
+			if len(candidates_responses[i].keys()) != 0:
+				continue
+
+			sessions[i].turn_metrics["fallback"] = True
+			candidates_responses[i] = {
+				emotion: response for emotion, response in latest_candidates_responses[i].items() if len(response) != 0
+			}
+			if len(candidates_responses[i].keys()) == 0:
+				candidates_responses[i] = {self.retry_policy.fallback_emotion: self.retry_policy.fallback_response}
+
+		return candidates_responses
 
 	@staticmethod
 	def __validate_response(response: str) -> bool:
 		return (len(response) != 0) and response.endswith((".", "!", "?"))
 
-	def __predict_user_response_emotion(self, candidate_responses: Dict[str, str]) -> Dict[str, Tensor]:
-		return {
-			k: get_emotion_composition(self.emotion_predictor(v, return_all_scores=True)[0])
-			for k, v in candidate_responses.items()
-		}
+	def __predict_user_response_emotion(
+		self, candidates_responses: List[Dict[str, str]], user_emotion_compositions: Tensor, queue_depth: int
+	) -> Tensor:
+		responses: list = [response for candidates in candidates_responses for response in candidates.values()]
+		if not self.use_transition_table:
+			return self.__classify_emotion("emotion_predictor", responses)
+
+		expected_compositions: Tensor = self.transition_table(user_emotion_compositions).cpu()
+		user_future_emotion_compositions: Tensor = torch.stack([
+			expected_compositions[i, emotions.index(emotion)]
+			for i, candidates in enumerate(candidates_responses)
+			for emotion in candidates.keys()
+		])
+
+		# the predictor refines the table estimate, it is skipped while the request backlog is deep
+		is_overloaded: bool = (
+			self.predictor_skip_queue_depth is not None and queue_depth >= self.predictor_skip_queue_depth
+		)
+		if self.predictor_refinement_weight != 0 and not is_overloaded:
+			user_future_emotion_compositions = torch.lerp(
+				user_future_emotion_compositions,
+				self.__classify_emotion("emotion_predictor", responses),
+				self.predictor_refinement_weight,
+			)
 
-	def __call__(
-		self, user_message: str, generation_config: Optional[GenerationConfig] = default_generation_config
-	) -> Dict[str, str]:
-		user_emotion_composition, user_emotion = self.__process_user_emotion(user_message)
+		return user_future_emotion_compositions
+
+	def __select_response_emotions(
+		self,
+		sessions: List[ChatSession],
+		user_messages: List[str],
+		generation_config: GenerationConfig,
+		queue_depth: int = 0,
+	) -> (List[str], List[Dict[str, str]]):
+		user_emotion_compositions, user_emotions = self.__process_user_emotion(user_messages)
+
+		bot_emotion_representations: Tensor = self.emotion_model.forward(
+			user_emotion_compositions, torch.stack([session.emotion_representation for session in sessions])
+		)
+
+		for session, bot_emotion_representation, user_emotion, user_message in zip(
+			sessions, bot_emotion_representations, user_emotions, user_messages
+		):
+			session.turn_metrics = {"num_attempts": 0, "retry_exhausted": False, "fallback": False}
+			self.__append_message(session, "user", user_emotion, user_message)
+
+			session.bot_emotion_representation = bot_emotion_representation
 
-		self.__append_message(user_emotion, user_message)
+		candidates_emotions: List[List[str]] = [emotions for _ in sessions]
+		if self.planner is not None:
+			candidates_emotions = self.planner(
+				self.emotion_model,
+				torch.stack([session.emotion_representation for session in sessions]),
+				user_emotion_compositions,
+			)
+
+		candidates_responses: List[Dict[str, str]] = self.__generate_valid_candidate_responses(
+			sessions, candidates_emotions, generation_config
+		)
 
-		self.bot_emotion_representation = self.emotion_model.forward(
-			user_emotion_composition, self.emotion_representation
+		user_future_emotion_compositions: Tensor = self.__predict_user_response_emotion(
+			candidates_responses, user_emotion_compositions, queue_depth
 		)
+		emotion_representations: Tensor = torch.stack([
+			session.emotion_representation
+			for session, candidates in zip(sessions, candidates_responses)
+			for _ in candidates.keys()
+		])
+
+		future_emotion_representations: Tensor = self.emotion_model.forward(
+			user_future_emotion_compositions, emotion_representations
+		)
+
+		emotion_representation_similarity_scores: Tensor = self.similarity_analyzer(future_emotion_representations)
 
-		while True:
-			candidates_responses = self.__generate_candidate_responses(generation_config)
-			candidates_responses = dict(
-				filter(lambda item: self.__validate_response(item[1]), candidates_responses.items())
+		best_response_emotions: List[str] = []
+		for candidates in candidates_responses:
+			session_scores: Tensor = emotion_representation_similarity_scores[: len(candidates)]
+			emotion_representation_similarity_scores = emotion_representation_similarity_scores[len(candidates) :]
+			best_response_emotions.append(list(candidates.keys())[session_scores.argmax().item()])
+
+		return best_response_emotions, candidates_responses
+
+	def __generate_responses(
+		self,
+		sessions: List[ChatSession],
+		response_emotions: List[str],
+		generation_config: GenerationConfig,
+		**generate_kwargs,
+	) -> List[str]:
+		if self.incremental_tokenization:
+			responses: List[str] = self.response_generator.generate_from_ids(
+				[
+					self.__get_prompt_ids(session, response_emotion)
+					for session, response_emotion in zip(sessions, response_emotions)
+				],
+				generation_config,
+				**generate_kwargs,
 			)
-			if len(candidates_responses.keys()) != 0:
-				break
 
-		user_future_emotion_compositions: dict = self.__predict_user_response_emotion(candidates_responses)
+			return [response.strip() for response in responses]
+
+		chats: list = self.response_generator(
+			[
+				self.__get_messages(session) + [self.__form_message("bot", response_emotion)]
+				for session, response_emotion in zip(sessions, response_emotions)
+			],
+			generation_config=generation_config,
+			batch_size=len(sessions),
+			decode_new_tokens_only=True,
+			**generate_kwargs,
+		)
 
-		future_emotion_representations: dict = {
-			k: self.emotion_model.forward(v, self.emotion_representation)
-			for k, v in user_future_emotion_compositions.items()
-		}
+		return [chat[0]["generated_text"][-1]["content"]["dialog"] for chat in chats]
 
-		emotion_representation_similarity_scores: Tensor = self.similarity_analyzer(
-			torch.stack(list(future_emotion_representations.values()))
+	def __audit_selected_responses(
+		self,
+		sessions: List[ChatSession],
+		response_emotions: List[str],
+		candidates_responses: List[Dict[str, str]],
+		selected_responses: List[str],
+		generation_config: GenerationConfig,
+	) -> None:
+		audited_indices: List[int] = [i for i in range(len(sessions)) if random.random() < self.selection_audit_rate]
+		if len(audited_indices) == 0:
+			return
+
+		regenerated_responses: List[str] = self.__generate_responses(
+			[sessions[i] for i in audited_indices], [response_emotions[i] for i in audited_indices], generation_config
 		)
-		best_response_emotion_index: int = emotion_representation_similarity_scores.argmax().item()
-		best_response_emotion: str = list(future_emotion_representations.keys())[best_response_emotion_index]
+		for i, response in zip(audited_indices, regenerated_responses):
+			if not self.__validate_response(response):
+				response = candidates_responses[i][response_emotions[i]]
+
+			self.selection_statistics["num_audited"] += 1
+			self.selection_statistics["num_disagreed"] += int(response != selected_responses[i])
 
-		self.__append_message(best_response_emotion)
-		self.messages = self.response_generator(self.__get_messages(), generation_config=generation_config)[0][1:]
-		response: str = self.messages[-1]["content"]["dialog"]
-		if not self.__validate_response(response):
-			self.messages[-1]["content"]["dialog"] = list(candidates_responses.values())[best_response_emotion_index]
+	@property
+	def selection_disagreement_rate(self) -> Optional[float]:
+		if self.selection_statistics["num_audited"] == 0:
+			return None
+
+		return self.selection_statistics["num_disagreed"] / self.selection_statistics["num_audited"]
+
+	def chat_batch(
+		self,
+		session_ids: List[str],
+		user_messages: List[str],
+		generation_config: Optional[GenerationConfig] = default_generation_config,
+		queue_depth: int = 0,
+		should_commit: Optional[Callable[[int], bool]] = None,
+	) -> List[Dict[str, str]]:
+		# queue_depth is the number of requests waiting behind this batch, it lets cheaper scoring kick in under load
+		# should_commit is asked once per session before its turn is stored, a caller that gave up answers False
+		if len(session_ids) != len(user_messages):
+			raise ValueError("session_ids and user_messages must have the same length")
+		if len(set(session_ids)) != len(session_ids):
+			raise ValueError("session_ids must be unique within a batch")
+
+		sessions: List[ChatSession] = [self.__get_session(session_id) for session_id in session_ids]
+
+		try:
+			best_response_emotions, candidates_responses = self.__select_response_emotions(
+				sessions, user_messages, generation_config, queue_depth
+			)
 
-		return {"emotion": best_response_emotion, "response": self.messages[-1]["content"]["dialog"]}
+			if self.response_selection == "regenerate":
+				responses: List[str] = [
+					response if self.__validate_response(response) else candidates[best_response_emotion]
+					for response, best_response_emotion, candidates in zip(
+						self.__generate_responses(sessions, best_response_emotions, generation_config),
+						best_response_emotions,
+						candidates_responses,
+					)
+				]
+			else:
+				responses: List[str] = [
+					candidates[best_response_emotion]
+					for best_response_emotion, candidates in zip(best_response_emotions, candidates_responses)
+				]
+				self.__audit_selected_responses(
+					sessions, best_response_emotions, candidates_responses, responses, generation_config
+				)
+
+			for i, (session_id, session, best_response_emotion, response) in enumerate(
+				zip(session_ids, sessions, best_response_emotions, responses)
+			):
+				if should_commit is not None and not should_commit(i):
+					self.__discard_user_turns([session])
+					continue
+
+				self.__append_message(session, "bot", best_response_emotion, response)
+				self.session_store.put(session_id, session)
+		except BaseException:
+			self.__discard_user_turns(sessions)
+			raise
+
+		return [
+			{"emotion": best_response_emotion, "response": response}
+			for best_response_emotion, response in zip(best_response_emotions, responses)
+		]
+
+	def __call__(
+		self,
+		user_message: str,
+		generation_config: Optional[GenerationConfig] = default_generation_config,
+		session_id: str = "default",
+	) -> Dict[str, str]:
+		return self.chat_batch([session_id], [user_message], generation_config)[0]
+
+	def stream(
+		self,
+		user_message: str,
+		generation_config: Optional[GenerationConfig] = default_generation_config,
+		session_id: str = "default",
+	) -> Iterator[Dict[str, str]]:
+		session: ChatSession = self.__get_session(session_id)
+
+		# the user turn is rolled back if the consumer stops early or generation fails
+		is_committed: bool = False
+		try:
+			best_response_emotions, candidates_responses = self.__select_response_emotions(
+				[session], [user_message], generation_config
+			)
+			best_response_emotion: str = best_response_emotions[0]
+			candidates: Dict[str, str] = candidates_responses[0]
+			yield {"emotion": best_response_emotion}
+
+			if self.response_selection == "regenerate":
+				streamer = TextIteratorStreamer(
+					self.response_generator.tokenizer,
+					skip_prompt=True,
+					timeout=streamer_poll_interval,
+					skip_special_tokens=True,
+					clean_up_tokenization_spaces=True,
+				)
+				with ThreadPoolExecutor(max_workers=1) as executor:
+					generation = executor.submit(
+						self.__generate_responses,
+						[session],
+						[best_response_emotion],
+						generation_config,
+						streamer=streamer,
+					)
+					while True:
+						try:
+							text: str = next(streamer)
+						except StopIteration:
+							break
+						except queue.Empty:
+							# a failed generation never ends the streamer, so its error is raised from here
+							if generation.done():
+								generation.result()
+							continue
+						if len(text) != 0:
+							yield {"token": text}
+					response: str = generation.result()[0]
+
+				if not self.__validate_response(response):
+					response = candidates[best_response_emotion]
+			else:
+				response: str = candidates[best_response_emotion]
+				yield {"token": response}
+				self.__audit_selected_responses(
+					[session], [best_response_emotion], [candidates], [response], generation_config
+				)
+
+			self.__append_message(session, "bot", best_response_emotion, response)
+			self.session_store.put(session_id, session)
+			is_committed = True
+		finally:
+			if not is_committed:
+				self.__discard_user_turns([session])
+
+		yield {"emotion": best_response_emotion, "response": response}
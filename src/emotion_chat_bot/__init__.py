@@ -0,0 +1,6 @@
+# unsloth patches transformers when it is imported, so it has to be loaded before any module imports transformers
+try:
+	import unsloth  # noqa: F401
+except (ImportError, NotImplementedError):
+	# only installed with the cuda extra and refuses to load without a gpu
+	pass
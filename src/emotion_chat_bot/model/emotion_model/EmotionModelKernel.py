@@ -0,0 +1,56 @@
+from typing import Optional, Union
+
+import numpy as np
+import torch
+from torch import Tensor
+
+from emotion_chat_bot.model.emotion_model.EmotionTransition import EmotionModel
+
+
+class EmotionModelKernel:
+	def __init__(self, weight_D: np.ndarray, bias_D: Optional[np.ndarray] = None) -> None:
+		if weight_D.shape != (7, 7):
+			raise ValueError("weight_D must be a (7, 7) matrix")
+
+		# only the diagonal of weight_D reaches the output, the attention score is a diagonal matrix
+		self.diagonal: np.ndarray = np.ascontiguousarray(np.diagonal(weight_D), dtype=np.float32)
+		self.bias: np.ndarray = (
+			np.zeros(7, dtype=np.float32) if bias_D is None else np.ascontiguousarray(bias_D, dtype=np.float32)
+		)
+
+	@classmethod
+	def from_emotion_model(cls, model: EmotionModel) -> "EmotionModelKernel":
+		state_dict: dict = model.state_dict()
+		bias_D: Optional[Tensor] = state_dict.get("_EmotionModel__weight_D.bias")
+
+		return cls(
+			state_dict["_EmotionModel__weight_D.weight"].detach().float().cpu().numpy(),
+			bias_D.detach().float().cpu().numpy() if bias_D is not None else None,
+		)
+
+	def forward(
+		self, representation: Union[np.ndarray, Tensor], input_emotion: Union[np.ndarray, Tensor]
+	) -> Union[np.ndarray, Tensor]:
+		return_tensor: bool = isinstance(representation, Tensor)
+		if isinstance(representation, Tensor):
+			representation = representation.detach().cpu().numpy()
+		if isinstance(input_emotion, Tensor):
+			input_emotion = input_emotion.detach().cpu().numpy()
+		representation = np.asarray(representation, dtype=np.float32)
+		input_emotion = np.asarray(input_emotion, dtype=np.float32)
+
+		# a single (1, 7) emotion applied to a (7,) representation keeps the (7,) output
+		while input_emotion.ndim > representation.ndim and input_emotion.shape[0] == 1:
+			input_emotion = input_emotion[0]
+
+		# input @ diag(representation) is an elementwise product, followed by a stable softmax
+		raw_attention: np.ndarray = input_emotion * representation
+		attention_score: np.ndarray = np.exp(raw_attention - raw_attention.max(-1, keepdims=True))
+		attention_score /= attention_score.sum(-1, keepdims=True)
+
+		difference: np.ndarray = np.clip(attention_score**3 * self.diagonal + self.bias, -1, 1)
+		new_representation: np.ndarray = representation + difference
+
+		return torch.from_numpy(new_representation) if return_tensor else new_representation
+
+	__call__ = forward
@@ -0,0 +1,81 @@
+from typing import Callable, List, Optional
+
+import torch
+from torch import Tensor
+
+from emotion_chat_bot.model.emotion_model.EmotionTransition import EmotionModel, SimilarityAnalyzer, emotions
+
+# maps (S, 7) user compositions to (S, 7, 7) expected user compositions, one row per bot emotion
+ReactionModel = Callable[[Tensor], Tensor]
+
+
+def mirror_reaction(user_emotion_compositions: Tensor, mirror_weight: float = 0.5) -> Tensor:
+	# the user keeps part of the current composition and moves the rest towards the bot emotion
+	bot_emotions: Tensor = torch.eye(len(emotions), dtype=torch.float32, device=user_emotion_compositions.device)
+
+	return torch.lerp(
+		user_emotion_compositions.to(dtype=torch.float32).unsqueeze(-2).expand(-1, len(emotions), -1),
+		bot_emotions,
+		mirror_weight,
+	)
+
+
+class EmotionTrajectoryPlanner:
+	def __init__(
+		self,
+		similarity_analyzer: SimilarityAnalyzer,
+		horizon: int = 1,
+		top_k: int = 3,
+		reaction_model: Optional[ReactionModel] = None,
+	) -> None:
+		if horizon < 1:
+			raise ValueError("horizon must be at least 1")
+		if not (1 <= top_k <= len(emotions)):
+			raise ValueError(f"top_k must between 1 and {len(emotions)} (inclusive)")
+
+		self.similarity_analyzer: SimilarityAnalyzer = similarity_analyzer
+		self.horizon: int = horizon
+		self.top_k: int = top_k
+		self.reaction_model: ReactionModel = reaction_model if reaction_model is not None else mirror_reaction
+
+	@torch.no_grad()
+	def rollout(
+		self, emotion_model: EmotionModel, emotion_representations: Tensor, user_emotion_compositions: Tensor
+	) -> Tensor:
+		num_sessions: int = user_emotion_compositions.shape[0]
+		# (S, 7, 7), row b is the expected user composition after a reply with bot emotion b
+		reactions: Tensor = self.reaction_model(user_emotion_compositions)
+		representations: Tensor = emotion_representations.unsqueeze(-2).expand(-1, len(emotions), -1)
+
+		# the arguments follow the order the bot scores its final candidates with, so that rank 1 agrees with it,
+		# the result is carried over every step and the user reacts again while the bot keeps emotion b
+		for step in range(self.horizon):
+			if step != 0:
+				reactions = (
+					self.reaction_model(reactions.reshape(-1, len(emotions)))
+					.reshape(num_sessions, len(emotions), len(emotions), len(emotions))
+					.diagonal(dim1=1, dim2=2)
+					.transpose(-1, -2)
+				)
+			representations = emotion_model.forward(reactions.to(representations.device), representations)
+
+		return representations
+
+	def score(
+		self, emotion_model: EmotionModel, emotion_representations: Tensor, user_emotion_compositions: Tensor
+	) -> Tensor:
+		future_emotion_representations: Tensor = self.rollout(
+			emotion_model, emotion_representations, user_emotion_compositions
+		)
+
+		return self.similarity_analyzer(future_emotion_representations.reshape(-1, len(emotions))).reshape(
+			-1, len(emotions)
+		)
+
+	def __call__(
+		self, emotion_model: EmotionModel, emotion_representations: Tensor, user_emotion_compositions: Tensor
+	) -> List[List[str]]:
+		scores: Tensor = self.score(emotion_model, emotion_representations, user_emotion_compositions)
+		ranks: Tensor = scores.argsort(dim=-1, descending=True, stable=True)[:, : self.top_k]
+
+		return [[emotions[index] for index in session_ranks] for session_ranks in ranks.tolist()]
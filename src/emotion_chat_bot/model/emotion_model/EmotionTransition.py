@@ -1,7 +1,5 @@
-import random
 from typing import Dict, List, Optional, Union
 
-import numpy
 import torch
 from huggingface_hub.hub_mixin import PyTorchModelHubMixin
 from torch import Tensor
@@ -11,21 +9,40 @@ from emotion_chat_bot.model.emotion_model.Attention import DotProductAttention
 emotions: list = ["neutral", "anger", "disgust", "fear", "happiness", "sadness", "surprise"]
 
 
-def generate_dummy_representation(target_emotion: int) -> Tensor:
-	weight_choice: numpy.ndarray = numpy.array([-1, 1])
-	while True:
-		dummy: Tensor = torch.rand(7, dtype=torch.float32)
-		weight: Tensor = torch.tensor(numpy.random.choice(weight_choice, (7,)), dtype=torch.float32)
-		dummy = torch.clamp(dummy * weight, -1, 1)
-		if torch.argmax(dummy) == target_emotion:
-			return dummy
+def sample_dummy_representations(target_emotions: Tensor, generator: Optional[torch.Generator] = None) -> Tensor:
+	target_emotions = target_emotions.long()
+	num_samples: int = target_emotions.shape[0]
+	magnitudes: Tensor = torch.rand((num_samples, 7), generator=generator, dtype=torch.float32)
+	signs: Tensor = torch.randint(0, 2, (num_samples, 7), generator=generator).float() * 2 - 1
+	dummies: Tensor = torch.clamp(magnitudes * signs, -1, 1)
 
+	# the elements are exchangeable, so swapping the maximum into the target position
+	# samples exactly the distribution of rejection sampling until argmax == target
+	rows: Tensor = torch.arange(num_samples)
+	max_indices: Tensor = dummies.argmax(-1)
+	max_values: Tensor = dummies[rows, max_indices]
+	dummies[rows, max_indices] = dummies[rows, target_emotions]
+	dummies[rows, target_emotions] = max_values
 
-def generate_representation(emotion_tendency: Optional[Union[int, Dict[str, float]]]) -> Tensor:
+	# break exact ties in favour of the target
+	tied: Tensor = dummies.argmax(-1) != target_emotions
+	tie_break_values: Tensor = torch.nextafter(max_values[tied], torch.tensor(float("inf"))).clamp(max=1)
+	dummies[rows[tied], target_emotions[tied]] = tie_break_values
+
+	return dummies
+
+
+def generate_dummy_representation(target_emotion: int, generator: Optional[torch.Generator] = None) -> Tensor:
+	return sample_dummy_representations(torch.tensor([target_emotion]), generator)[0]
+
+
+def generate_representation(
+	emotion_tendency: Optional[Union[int, Dict[str, float]]], generator: Optional[torch.Generator] = None
+) -> Tensor:
 	if emotion_tendency is None:
-		return generate_dummy_representation(random.randint(0, 6))
+		return generate_dummy_representation(torch.randint(0, 7, (1,), generator=generator).item(), generator)
 	if isinstance(emotion_tendency, int):
-		return generate_dummy_representation(emotion_tendency)
+		return generate_dummy_representation(emotion_tendency, generator)
 
 	return torch.tensor([emotion_tendency[emotion] for emotion in emotions]).clamp(-1, 1)
 
@@ -36,6 +53,14 @@ def get_emotion_composition(analysis_result: list) -> Tensor:
 	return torch.tensor(sentiment_composition, dtype=torch.float32).softmax(dim=-1)
 
 
+def get_emotion_compositions(analysis_results: List[list]) -> Tensor:
+	sentiment_compositions: list = [
+		[result["score"] for result in analysis_result] for analysis_result in analysis_results
+	]
+
+	return torch.tensor(sentiment_compositions, dtype=torch.float32).softmax(dim=-1)
+
+
 def representation_evolute(
 	model, bot_emotion_representations: List[Tensor], user_emotion_compositions: List[Tensor]
 ) -> List[Tensor]:
@@ -47,6 +72,42 @@ def representation_evolute(
 	return evolute_representations
 
 
+def representation_evolute_batched(
+	model, bot_emotion_representations: Tensor, user_emotion_compositions: Tensor, mask: Tensor
+) -> Tensor:
+	# (B, 7) initial representations evolve over (B, T, 7) compositions in one scan, padded steps keep the state
+	evolute_representations: list = []
+	representations: Tensor = bot_emotion_representations
+	for t in range(user_emotion_compositions.shape[1]):
+		new_representations: Tensor = model.forward(representations, user_emotion_compositions[:, t])
+		representations = torch.where(mask[:, t].unsqueeze(-1), new_representations, representations)
+		evolute_representations.append(representations)
+
+	return torch.stack(evolute_representations, dim=1)
+
+
+def collate_emotion_transitions(samples: List[dict], ignore_index: int = -100) -> Dict[str, Tensor]:
+	user_emotion_compositions: list = [sample["user_emotion_compositions"].reshape(-1, 7) for sample in samples]
+	bot_emotions: list = [sample["bot_emotion"].long() for sample in samples]
+	bot_emotions = [
+		emotion[: len(composition)] for emotion, composition in zip(bot_emotions, user_emotion_compositions)
+	]
+
+	labels: Tensor = torch.nn.utils.rnn.pad_sequence(bot_emotions, batch_first=True, padding_value=ignore_index)
+
+	return {
+		"bot_initial_emotion_representation": torch.stack([
+			sample["bot_initial_emotion_representation"].reshape(7) for sample in samples
+		]),
+		"user_emotion_compositions": torch.nn.utils.rnn.pad_sequence(
+			[composition[: len(emotion)] for composition, emotion in zip(user_emotion_compositions, bot_emotions)],
+			batch_first=True,
+		),
+		"bot_emotion": labels,
+		"mask": labels != ignore_index,
+	}
+
+
 # for sweep
 # def initialize_attention(attention: str, bias: bool = True, dtype: torch.dtype = torch.float) -> torch.nn.Module:
 # 	match attention:
@@ -75,11 +136,17 @@ class EmotionModel(torch.nn.Module, PyTorchModelHubMixin):
 		representation = representation.to(dtype=self.dtype)
 		input_emotion = input_emotion.to(dtype=self.dtype)
 
-		raw_attention: Tensor = self.__attention.forward(input_emotion, representation.squeeze().diag())
+		# a single (1, 7) emotion applied to a (7,) representation keeps the (7,) output
+		while input_emotion.dim() > representation.dim() and input_emotion.shape[0] == 1:
+			input_emotion = input_emotion.squeeze(0)
+
+		raw_attention: Tensor = self.__attention.forward(
+			input_emotion.unsqueeze(-2), representation.diag_embed()
+		).squeeze(-2)
 
-		attention_score: Tensor = raw_attention.softmax(-1).squeeze().diag()
+		attention_score: Tensor = raw_attention.softmax(-1).diag_embed()
 
-		difference: Tensor = torch.clamp(torch.diagonal(self.__weight_D((attention_score**3))), -1, 1)
+		difference: Tensor = torch.diagonal(self.__weight_D((attention_score**3)), dim1=-2, dim2=-1).clamp(-1, 1)
 
 		return representation + difference
 
@@ -128,3 +195,71 @@ class SimilarityAnalyzer:
 		similarity_scores = similarity_scores * score_filter
 
 		return similarity_scores
+
+
+class MultiPersonaSimilarityAnalyzer:
+	def __init__(
+		self, ideal_emotion_representations: Tensor, thresholds: Union[float, List[float], Tensor] = 0.7
+	) -> None:
+		if ideal_emotion_representations.dim() != 2:
+			raise ValueError("ideal_emotion_representations must be a (num_personas, 7) tensor")
+		thresholds = torch.as_tensor(thresholds, dtype=torch.float32).expand(ideal_emotion_representations.shape[0])
+		if not torch.all((0 < thresholds) & (thresholds < 1)):
+			raise ValueError("thresholds must between 0 and 1 (exclusive)")
+
+		self.__thresholds: Tensor = thresholds.clone()
+		self.__ideal_emotion_representations: Tensor = ideal_emotion_representations
+		self.__length_of_ideal_emotion_representations: Tensor = torch.norm(ideal_emotion_representations, dim=-1)
+
+	@classmethod
+	def from_similarity_analyzers(cls, analyzers: List[SimilarityAnalyzer]) -> "MultiPersonaSimilarityAnalyzer":
+		return cls(
+			torch.stack([analyzer.ideal_emotion_representation for analyzer in analyzers]),
+			[analyzer.threshold for analyzer in analyzers],
+		)
+
+	@property
+	def num_personas(self) -> int:
+		return self.__ideal_emotion_representations.shape[0]
+
+	@property
+	def thresholds(self) -> Tensor:
+		return self.__thresholds
+
+	@property
+	def ideal_emotion_representations(self) -> Tensor:
+		return self.__ideal_emotion_representations
+
+	def __call__(self, representations: Tensor, persona_indices: Optional[Tensor] = None) -> Tensor:
+		# representations is (B, N, 7), row b is scored against persona persona_indices[b] (b itself by default)
+		if persona_indices is None:
+			if representations.shape[0] != self.num_personas:
+				raise ValueError("representations must have one row per persona when persona_indices is not given")
+			persona_indices = torch.arange(self.num_personas)
+		persona_indices = persona_indices.to(self.__ideal_emotion_representations.device)
+
+		ideal_emotion_representations: Tensor = self.__ideal_emotion_representations[persona_indices].to(
+			representations.device
+		)
+		length_of_ideal_emotion_representations: Tensor = self.__length_of_ideal_emotion_representations[
+			persona_indices
+		].to(representations.device)
+		thresholds: Tensor = self.__thresholds[persona_indices.cpu()].to(representations.device)
+
+		length_of_representations: Tensor = torch.norm(representations, dim=-1)
+
+		length_ratio_between_representations: Tensor = (
+			length_of_representations / length_of_ideal_emotion_representations.unsqueeze(-1)
+		)
+
+		similarity_between_representations: Tensor = torch.cosine_similarity(
+			representations, ideal_emotion_representations.unsqueeze(-2), dim=-1
+		)
+
+		similarity_scores: Tensor = similarity_between_representations * length_ratio_between_representations
+		similarity_scores = torch.clamp(similarity_scores, min=0, max=1)
+
+		score_filter: Tensor = similarity_scores <= thresholds.unsqueeze(-1)
+		similarity_scores = similarity_scores * score_filter
+
+		return similarity_scores
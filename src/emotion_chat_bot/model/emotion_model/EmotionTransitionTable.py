@@ -0,0 +1,48 @@
+import torch
+from huggingface_hub.hub_mixin import PyTorchModelHubMixin
+from torch import Tensor
+
+from emotion_chat_bot.model.emotion_model.EmotionTransition import emotions
+
+
+class EmotionTransitionTable(torch.nn.Module, PyTorchModelHubMixin):
+	def __init__(self, dtype: torch.dtype = torch.float32) -> None:
+		super(EmotionTransitionTable, self).__init__()
+
+		self.dtype: torch.dtype = dtype
+		# (user emotion, bot emotion) -> expected composition of the next user message
+		self.register_buffer(
+			"transition_table",
+			torch.full((len(emotions), len(emotions), len(emotions)), 1 / len(emotions), dtype=dtype),
+		)
+
+	@torch.no_grad()
+	def fit(
+		self,
+		user_emotion_compositions: Tensor,
+		bot_emotions: Tensor,
+		next_user_emotion_compositions: Tensor,
+		smoothing: float = 1.0,
+	) -> "EmotionTransitionTable":
+		if smoothing < 0:
+			raise ValueError("smoothing must be non-negative")
+
+		user_emotion_compositions = user_emotion_compositions.to(dtype=self.dtype)
+		next_user_emotion_compositions = next_user_emotion_compositions.to(dtype=self.dtype)
+		bot_emotions = torch.nn.functional.one_hot(bot_emotions.long(), len(emotions)).to(dtype=self.dtype)
+
+		# user emotions are soft-assigned by their composition, unseen pairs fall back to the overall mean
+		sums: Tensor = torch.einsum(
+			"ku,kb,kc->ubc", user_emotion_compositions, bot_emotions, next_user_emotion_compositions
+		)
+		counts: Tensor = torch.einsum("ku,kb->ub", user_emotion_compositions, bot_emotions)
+		prior: Tensor = next_user_emotion_compositions.mean(0)
+
+		self.transition_table.copy_((sums + smoothing * prior) / (counts + smoothing).unsqueeze(-1))
+
+		return self
+
+	def forward(self, user_emotion_compositions: Tensor) -> Tensor:
+		user_emotion_compositions = user_emotion_compositions.to(dtype=self.dtype, device=self.transition_table.device)
+
+		return torch.einsum("su,ubc->sbc", user_emotion_compositions, self.transition_table)
@@ -1,9 +1,68 @@
-from transformers import TextGenerationPipeline
+import copy
+from typing import Any, Dict, List, Optional
+
+import torch
+from torch import Tensor
+from transformers import DynamicCache, GenerationConfig, TextGenerationPipeline
 from transformers.pipelines.text_generation import Chat, ReturnType
 
+empty_system_message: Dict[str, Any] = {"role": "system", "content": {"emotion": "", "dialog": ""}}
+placeholder_user_message: Dict[str, Any] = {"role": "user", "content": {"emotion": "neutral", "dialog": "Hi."}}
+probe_system_message: Dict[str, Any] = {"role": "system", "content": {"emotion": "", "dialog": "You are a chat bot."}}
+probe_messages: List[Dict[str, Any]] = [
+	{"role": "user", "content": {"emotion": "neutral", "dialog": "Hi, how are you?"}},
+	{"role": "bot", "content": {"emotion": "happiness", "dialog": "I am fine, thanks."}},
+	{"role": "user", "content": {"emotion": "sadness", "dialog": "Not so good today..."}},
+]
+
+
+def left_pad(sequences: List[List[int]], pad_token_id: int) -> (Tensor, Tensor):
+	max_length: int = max(len(sequence) for sequence in sequences)
+	input_ids: Tensor = torch.tensor([
+		[pad_token_id] * (max_length - len(sequence)) + sequence for sequence in sequences
+	])
+	attention_mask: Tensor = torch.tensor([
+		[0] * (max_length - len(sequence)) + [1] * len(sequence) for sequence in sequences
+	])
+
+	return input_ids, attention_mask
+
+
+def common_prefix_length(sequences: List[List[int]]) -> int:
+	prefix_length: int = 0
+	for tokens in zip(*sequences):
+		if any(token != tokens[0] for token in tokens[1:]):
+			break
+		prefix_length += 1
+
+	# generate needs at least one uncached token for every sequence
+	return min(prefix_length, min(len(sequence) for sequence in sequences) - 1)
+
 
 class ResponseGeneratorPipeline(TextGenerationPipeline):
-	def postprocess(self, model_outputs, return_type=ReturnType.FULL_TEXT, clean_up_tokenization_spaces=True):
+	def __init__(self, *args, **kwargs) -> None:
+		super().__init__(*args, **kwargs)
+
+		self.__generation_prompt_ids: Dict[str, List[int]] = {}
+		self.__incremental_tokenization_support: Dict[str, bool] = {}
+
+	def _sanitize_parameters(self, decode_new_tokens_only=None, **generate_kwargs):
+		preprocess_params, forward_params, postprocess_params = super()._sanitize_parameters(**generate_kwargs)
+		if decode_new_tokens_only is not None:
+			postprocess_params["decode_new_tokens_only"] = decode_new_tokens_only
+
+		return preprocess_params, forward_params, postprocess_params
+
+	def postprocess(
+		self,
+		model_outputs,
+		return_type=ReturnType.FULL_TEXT,
+		clean_up_tokenization_spaces=True,
+		decode_new_tokens_only=False,
+	):
+		if decode_new_tokens_only and return_type != ReturnType.TENSORS:
+			return self.__postprocess_new_tokens(model_outputs, return_type, clean_up_tokenization_spaces)
+
 		generated_sequence = model_outputs["generated_sequence"][0]
 		input_ids = model_outputs["input_ids"]
 		prompt_text = model_outputs["prompt_text"]
@@ -36,9 +95,206 @@ class ResponseGeneratorPipeline(TextGenerationPipeline):
 						all_text = prompt_text + all_text
 					elif isinstance(prompt_text, Chat):
 						# Explicit list parsing is necessary for parsing chat datasets
-						prompt_text.messages[-1]["content"]["dialog"] = all_text
-						all_text = list(prompt_text.messages)
+						all_text = self.__complete_chat(prompt_text, all_text)
 				record = all_text
 			records.append(record)
 
 		return records
+
+	@staticmethod
+	def __complete_chat(chat: Chat, dialog: str) -> List[Dict[str, Any]]:
+		# every returned sequence gets its own last message
+		last_message: Dict[str, Any] = copy.deepcopy(chat.messages[-1])
+		last_message["content"]["dialog"] = dialog
+
+		return list(chat.messages[:-1]) + [last_message]
+
+	def __postprocess_new_tokens(
+		self, model_outputs, return_type: ReturnType, clean_up_tokenization_spaces: bool
+	) -> List[Dict[str, Any]]:
+		generated_sequence: Tensor = model_outputs["generated_sequence"][0]
+		input_ids: Optional[Tensor] = model_outputs["input_ids"]
+		prompt_text = model_outputs["prompt_text"]
+
+		prompt_length: int = 0 if input_ids is None else input_ids.shape[-1]
+		new_token_ids: Tensor = generated_sequence[:, prompt_length:]
+		num_generated_tokens: List[int] = (new_token_ids != self.tokenizer.pad_token_id).sum(-1).tolist()
+		texts: List[str] = self.tokenizer.batch_decode(
+			new_token_ids, skip_special_tokens=True, clean_up_tokenization_spaces=clean_up_tokenization_spaces
+		)
+
+		records: list = []
+		for text, num_tokens in zip(texts, num_generated_tokens):
+			generated_text = text.strip()
+			if return_type == ReturnType.FULL_TEXT:
+				if isinstance(prompt_text, str):
+					generated_text = prompt_text + generated_text
+				elif isinstance(prompt_text, Chat):
+					generated_text = self.__complete_chat(prompt_text, generated_text)
+			records.append({"generated_text": generated_text, "num_generated_tokens": num_tokens})
+
+		return records
+
+	def tokenize_message(
+		self,
+		message: Dict[str, Any],
+		system_message: Optional[Dict[str, Any]] = None,
+		add_generation_prompt: bool = False,
+	) -> List[int]:
+		# render the message after a minimal context of the right parity and keep only its own part
+		context: list = [system_message if system_message is not None else empty_system_message]
+		if message["role"] != "user":
+			context.append(placeholder_user_message)
+
+		context_text: str = self.tokenizer.apply_chat_template(context, tokenize=False)
+		text: str = self.tokenizer.apply_chat_template(
+			context + [message], tokenize=False, add_generation_prompt=add_generation_prompt
+		)
+		if not text.startswith(context_text):
+			raise ValueError("chat template cannot be rendered message by message")
+
+		return self.tokenizer.encode(text[len(context_text) :], add_special_tokens=False)
+
+	def tokenize_chat(self, messages: List[Dict[str, Any]], add_generation_prompt: bool = False) -> List[int]:
+		return self.tokenizer.apply_chat_template(
+			messages, tokenize=True, add_generation_prompt=add_generation_prompt, return_dict=False
+		)
+
+	@property
+	def supports_incremental_tokenization(self) -> bool:
+		# tokens merged across a message boundary make the per message pieces differ from the full prompt,
+		# so the pieces are compared with the full tokenization once per chat template
+		chat_template: str = self.tokenizer.chat_template
+		if chat_template not in self.__incremental_tokenization_support:
+			self.__incremental_tokenization_support[chat_template] = all(
+				self.__matches_full_tokenization(system_message)
+				for system_message in [empty_system_message, probe_system_message]
+			)
+
+		return self.__incremental_tokenization_support[chat_template]
+
+	def __matches_full_tokenization(self, system_message: Dict[str, Any]) -> bool:
+		try:
+			pieces_ids: List[int] = [
+				token_id
+				for i, message in enumerate(probe_messages)
+				for token_id in self.tokenize_message(message, system_message if i == 0 else None)
+			] + self.generation_prompt_ids("neutral")
+		except ValueError:
+			return False
+
+		return pieces_ids == self.tokenize_chat(
+			[system_message] + probe_messages + [{"role": "bot", "content": {"emotion": "neutral", "dialog": ""}}],
+			add_generation_prompt=True,
+		)
+
+	def generation_prompt_ids(self, emotion: str) -> List[int]:
+		if emotion not in self.__generation_prompt_ids:
+			self.__generation_prompt_ids[emotion] = self.tokenize_message(
+				{"role": "bot", "content": {"emotion": emotion, "dialog": ""}}, add_generation_prompt=True
+			)
+
+		return self.__generation_prompt_ids[emotion]
+
+	def generate_from_ids(
+		self,
+		prompts_ids: List[List[int]],
+		generation_config: GenerationConfig,
+		clean_up_tokenization_spaces: bool = True,
+		**generate_kwargs,
+	) -> List[str]:
+		input_ids, attention_mask = left_pad(prompts_ids, self.tokenizer.pad_token_id)
+
+		generated_sequences: Tensor = self.model.generate(
+			input_ids=input_ids.to(self.device),
+			attention_mask=attention_mask.to(self.device),
+			generation_config=generation_config,
+			**generate_kwargs,
+		)
+
+		return self.tokenizer.batch_decode(
+			generated_sequences[:, input_ids.shape[-1] :],
+			skip_special_tokens=True,
+			clean_up_tokenization_spaces=clean_up_tokenization_spaces,
+		)
+
+	def generate_from_shared_prefix(
+		self,
+		chats: List[List[Dict[str, Any]]],
+		last_messages: List[List[Dict[str, Any]]],
+		generation_config: GenerationConfig,
+		clean_up_tokenization_spaces: bool = True,
+	) -> List[List[str]]:
+		return self.generate_from_shared_prefix_ids(
+			[
+				[
+					self.tokenize_chat(chat + [last_message], add_generation_prompt=True)
+					for last_message in chat_last_messages
+				]
+				for chat, chat_last_messages in zip(chats, last_messages)
+			],
+			generation_config,
+			clean_up_tokenization_spaces,
+		)
+
+	def generate_from_shared_prefix_ids(
+		self,
+		candidates_ids: List[List[List[int]]],
+		generation_config: GenerationConfig,
+		clean_up_tokenization_spaces: bool = True,
+	) -> List[List[str]]:
+		prefix_lengths: List[int] = [common_prefix_length(candidate_ids) for candidate_ids in candidates_ids]
+
+		prefix_ids, prefix_attention_mask = left_pad(
+			[candidate_ids[0][:length] for candidate_ids, length in zip(candidates_ids, prefix_lengths)],
+			self.tokenizer.pad_token_id,
+		)
+		prefix_ids, prefix_attention_mask = prefix_ids.to(self.device), prefix_attention_mask.to(self.device)
+		prefix_position_ids: Tensor = (prefix_attention_mask.cumsum(-1) - 1).masked_fill(prefix_attention_mask == 0, 1)
+
+		with torch.no_grad():
+			# an explicit cache object keeps the output a DynamicCache on every supported transformers version
+			past_key_values: DynamicCache = self.model(
+				input_ids=prefix_ids,
+				attention_mask=prefix_attention_mask,
+				position_ids=prefix_position_ids,
+				past_key_values=DynamicCache(),
+				use_cache=True,
+			).past_key_values
+
+		num_candidates: Tensor = torch.tensor([len(candidate_ids) for candidate_ids in candidates_ids])
+		past_key_values.batch_select_indices(
+			torch.arange(len(candidates_ids), device=self.device).repeat_interleave(num_candidates.to(self.device))
+		)
+
+		suffix_ids, suffix_attention_mask = left_pad(
+			[ids[length:] for candidate_ids, length in zip(candidates_ids, prefix_lengths) for ids in candidate_ids],
+			self.tokenizer.pad_token_id,
+		)
+		num_candidates = num_candidates.to(self.device)
+		input_ids: Tensor = torch.cat(
+			[prefix_ids.repeat_interleave(num_candidates, dim=0), suffix_ids.to(self.device)], dim=-1
+		)
+		attention_mask: Tensor = torch.cat(
+			[prefix_attention_mask.repeat_interleave(num_candidates, dim=0), suffix_attention_mask.to(self.device)],
+			dim=-1,
+		)
+
+		generated_sequences: Tensor = self.model.generate(
+			input_ids=input_ids,
+			attention_mask=attention_mask,
+			past_key_values=past_key_values,
+			generation_config=generation_config,
+		)
+		responses: List[str] = self.tokenizer.batch_decode(
+			generated_sequences[:, input_ids.shape[-1] :],
+			skip_special_tokens=True,
+			clean_up_tokenization_spaces=clean_up_tokenization_spaces,
+		)
+
+		chats_responses: List[List[str]] = []
+		for candidate_ids in candidates_ids:
+			chats_responses.append(responses[: len(candidate_ids)])
+			responses = responses[len(candidate_ids) :]
+
+		return chats_responses
@@ -0,0 +1,189 @@
+import asyncio
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from threading import Lock
+from typing import Deque, Dict, List, Optional
+
+from transformers import GenerationConfig
+
+from emotion_chat_bot.EmotionChatBot import EmotionChatBot, default_generation_config
+
+
+class QueueFullError(RuntimeError):
+	pass
+
+
+@dataclass
+class ChatRequest:
+	session_id: str
+	message: str
+	future: asyncio.Future
+	# set under the coalescer's state lock, exactly one of them wins for a request that reaches the bot
+	is_committed: bool = False
+	is_abandoned: bool = False
+
+
+class RequestCoalescer:
+	def __init__(
+		self,
+		bot: EmotionChatBot,
+		max_batch_size: int = 8,
+		max_wait_time: float = 0.005,
+		max_queue_size: int = 256,
+		request_timeout: Optional[float] = 30.0,
+		generation_config: Optional[GenerationConfig] = default_generation_config,
+		executor: Optional[Executor] = None,
+	) -> None:
+		if max_batch_size < 1:
+			raise ValueError("max_batch_size must be at least 1")
+		if max_wait_time < 0:
+			raise ValueError("max_wait_time must not be negative")
+
+		self.__bot: EmotionChatBot = bot
+		self.__max_batch_size: int = max_batch_size
+		self.__max_wait_time: float = max_wait_time
+		self.__max_queue_size: int = max_queue_size
+		self.__request_timeout: Optional[float] = request_timeout
+		self.__generation_config: GenerationConfig = generation_config
+		self.__executor: Executor = executor if executor is not None else ThreadPoolExecutor(max_workers=1)
+		self.__queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+		self.__deferred_requests: Deque[ChatRequest] = deque()
+		self.__batch: List[ChatRequest] = []
+		self.__task: Optional[asyncio.Task] = None
+		self.__state_lock: Lock = Lock()
+
+	@property
+	def queue_depth(self) -> int:
+		return self.__queue.qsize() + len(self.__deferred_requests)
+
+	def start(self) -> None:
+		if self.__task is None:
+			self.__task = asyncio.get_running_loop().create_task(self.__run())
+
+	async def stop(self) -> None:
+		if self.__task is not None:
+			self.__task.cancel()
+			try:
+				await self.__task
+			except asyncio.CancelledError:
+				pass
+			self.__task = None
+
+		for request in self.__batch:
+			request.future.cancel()
+		self.__batch = []
+		while len(self.__deferred_requests) != 0:
+			self.__deferred_requests.popleft().future.cancel()
+		while not self.__queue.empty():
+			self.__queue.get_nowait().future.cancel()
+
+	async def submit(self, session_id: str, message: str) -> Dict[str, str]:
+		# deferred requests have already left the queue but still count against its capacity
+		if self.queue_depth >= self.__max_queue_size:
+			raise QueueFullError("request queue is full")
+
+		request = ChatRequest(session_id, message, asyncio.get_running_loop().create_future())
+		try:
+			self.__queue.put_nowait(request)
+		except asyncio.QueueFull:
+			raise QueueFullError("request queue is full") from None
+
+		try:
+			return await asyncio.wait_for(asyncio.shield(request.future), self.__request_timeout)
+		except asyncio.TimeoutError:
+			# a timed out request must not be stored later, or a retrying client would be recorded twice
+			if self.__abandon(request):
+				raise
+			return await request.future
+		except asyncio.CancelledError:
+			self.__abandon(request)
+			raise
+
+	def __abandon(self, request: ChatRequest) -> bool:
+		with self.__state_lock:
+			if request.is_committed:
+				return False
+			request.is_abandoned = True
+		request.future.cancel()
+
+		return True
+
+	def __claim(self, batch: List[ChatRequest], index: int) -> bool:
+		# called from the executor right before the bot stores the turn of batch[index]
+		with self.__state_lock:
+			if batch[index].is_abandoned:
+				return False
+			batch[index].is_committed = True
+
+		return True
+
+	async def __next_request(self, timeout: Optional[float]) -> ChatRequest:
+		if len(self.__deferred_requests) != 0:
+			return self.__deferred_requests.popleft()
+		if timeout is None:
+			return await self.__queue.get()
+
+		return await asyncio.wait_for(self.__queue.get(), timeout)
+
+	async def __collect_batch(self) -> List[ChatRequest]:
+		loop = asyncio.get_running_loop()
+
+		batch: List[ChatRequest] = self.__batch
+		batch.append(await self.__next_request(None))
+		conflicting_requests: List[ChatRequest] = []
+		deadline: float = loop.time() + self.__max_wait_time
+		try:
+			while len(batch) < self.__max_batch_size:
+				timeout: float = deadline - loop.time()
+				if timeout <= 0:
+					break
+				try:
+					request: ChatRequest = await self.__next_request(timeout)
+				except asyncio.TimeoutError:
+					break
+
+				# a session can only take one turn per batch, later messages wait for the next one
+				if any(request.session_id == queued_request.session_id for queued_request in batch):
+					conflicting_requests.append(request)
+				else:
+					batch.append(request)
+		finally:
+			self.__deferred_requests.extendleft(reversed(conflicting_requests))
+
+		return [request for request in batch if not request.future.done()]
+
+	async def __run(self) -> None:
+		loop = asyncio.get_running_loop()
+		while True:
+			# the batch in collection or in flight is tracked so stop() can cancel its callers
+			self.__batch = []
+			batch: List[ChatRequest] = await self.__collect_batch()
+			self.__batch = batch
+			if len(batch) == 0:
+				continue
+
+			try:
+				results: List[Dict[str, str]] = await loop.run_in_executor(
+					self.__executor,
+					self.__bot.chat_batch,
+					[request.session_id for request in batch],
+					[request.message for request in batch],
+					self.__generation_config,
+					self.queue_depth,
+					partial(self.__claim, batch),
+				)
+			except asyncio.CancelledError:
+				for request in batch:
+					request.future.cancel()
+				raise
+			except Exception as exception:
+				for request in batch:
+					if not request.future.done():
+						request.future.set_exception(exception)
+				continue
+
+			for request, result in zip(batch, results):
+				if not request.future.done():
+					request.future.set_result(result)
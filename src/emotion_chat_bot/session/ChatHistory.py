@@ -0,0 +1,148 @@
+from typing import Any, Dict, Iterator, List, Optional
+
+from emotion_chat_bot.model.emotion_model.EmotionTransition import emotions
+
+roles: List[str] = ["user", "bot"]
+
+
+class Turn:
+	__slots__ = ("role_id", "emotion_id", "dialog", "token_ids", "__message")
+
+	def __init__(self, role_id: int, emotion_id: int, dialog: str, token_ids: Optional[List[int]] = None) -> None:
+		# role and emotion are kept as small ids, the template-facing dict is only built when needed
+		if not (0 <= role_id < len(roles)) or not (0 <= emotion_id < len(emotions)):
+			raise ValueError("role_id and emotion_id must index roles and emotions")
+
+		self.role_id: int = role_id
+		self.emotion_id: int = emotion_id
+		self.dialog: str = dialog
+		self.token_ids: Optional[List[int]] = token_ids
+		self.__message: Optional[Dict[str, Any]] = None
+
+	@classmethod
+	def from_message(cls, role: str, emotion: str, dialog: str) -> "Turn":
+		return cls(roles.index(role), emotions.index(emotion), dialog)
+
+	def to_list(self) -> List[Any]:
+		return [self.role_id, self.emotion_id, self.dialog, self.token_ids]
+
+	@classmethod
+	def from_list(cls, state: List[Any]) -> "Turn":
+		return cls(*state)
+
+	@property
+	def role(self) -> str:
+		return roles[self.role_id]
+
+	@property
+	def emotion(self) -> str:
+		return emotions[self.emotion_id]
+
+	@property
+	def num_tokens(self) -> int:
+		if self.token_ids is None:
+			raise ValueError("turn has not been tokenized")
+
+		return len(self.token_ids)
+
+	@property
+	def message(self) -> Dict[str, Any]:
+		if self.__message is None:
+			self.__message = {"role": self.role, "content": {"emotion": self.emotion, "dialog": self.dialog}}
+
+		return self.__message
+
+
+class ChatHistory:
+	def __init__(self, capacity: Optional[int] = None) -> None:
+		if capacity is not None and capacity < 1:
+			raise ValueError("capacity must be at least 1")
+
+		self.capacity: Optional[int] = capacity
+		self.__turns: List[Optional[Turn]] = [None] * (capacity if capacity is not None else 8)
+		self.__start: int = 0
+		self.__length: int = 0
+		self.__messages: Optional[List[Dict[str, Any]]] = None
+		self.__system_message: Optional[Dict[str, Any]] = None
+
+	def __len__(self) -> int:
+		return self.__length
+
+	def __getitem__(self, index: int) -> Turn:
+		if index < 0:
+			index += self.__length
+		if not (0 <= index < self.__length):
+			raise IndexError("turn index out of range")
+
+		return self.__turns[(self.__start + index) % len(self.__turns)]
+
+	def __iter__(self) -> Iterator[Turn]:
+		for i in range(self.__length):
+			yield self.__turns[(self.__start + i) % len(self.__turns)]
+
+	@property
+	def is_full(self) -> bool:
+		return self.capacity is not None and self.__length == self.capacity
+
+	def __grow(self) -> None:
+		self.__turns = list(self) + [None] * len(self.__turns)
+		self.__start = 0
+
+	def append(self, turn: Turn) -> None:
+		if self.is_full:
+			raise OverflowError("chat history is full, drop the oldest turns first")
+		if self.__length != 0 and self[-1].role_id == turn.role_id:
+			raise ValueError("turns must alternate between user and bot")
+		if self.__length == len(self.__turns):
+			self.__grow()
+
+		self.__turns[(self.__start + self.__length) % len(self.__turns)] = turn
+		self.__length += 1
+		if self.__messages is not None:
+			self.__messages.append(turn.message)
+
+	def drop_oldest(self, num_turns: int) -> List[Turn]:
+		num_turns = min(num_turns, self.__length)
+		dropped_turns: List[Turn] = []
+		for _ in range(num_turns):
+			dropped_turns.append(self.__turns[self.__start])
+			self.__turns[self.__start] = None
+			self.__start = (self.__start + 1) % len(self.__turns)
+		self.__length -= num_turns
+		if self.__messages is not None:
+			offset: int = 0 if self.__system_message is None else 1
+			del self.__messages[offset : offset + num_turns]
+
+		return dropped_turns
+
+	def drop_latest(self) -> Turn:
+		if self.__length == 0:
+			raise IndexError("chat history is empty")
+
+		self.__length -= 1
+		index: int = (self.__start + self.__length) % len(self.__turns)
+		dropped_turn: Turn = self.__turns[index]
+		self.__turns[index] = None
+		if self.__messages is not None:
+			self.__messages.pop()
+
+		return dropped_turn
+
+	def messages(self, system_message: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+		# the list is cached between turns, callers must not modify it in place
+		if self.__messages is None or self.__system_message is not system_message:
+			self.__system_message = system_message
+			self.__messages = ([system_message] if system_message is not None else []) + [turn.message for turn in self]
+
+		return self.__messages
+
+	def to_dict(self) -> Dict[str, Any]:
+		return {"capacity": self.capacity, "turns": [turn.to_list() for turn in self]}
+
+	@classmethod
+	def from_dict(cls, state: Dict[str, Any]) -> "ChatHistory":
+		history = cls(state["capacity"])
+		for turn_state in state["turns"]:
+			history.append(Turn.from_list(turn_state))
+
+		return history
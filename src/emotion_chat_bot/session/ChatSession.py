@@ -0,0 +1,22 @@
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from torch import Tensor
+
+from emotion_chat_bot.model.emotion_model.EmotionTransition import generate_representation
+from emotion_chat_bot.session.ChatHistory import ChatHistory, Turn
+
+
+@dataclass
+class ChatSession:
+	history: ChatHistory = field(default_factory=ChatHistory)
+	emotion_representation: Tensor = field(default_factory=lambda: generate_representation(None))
+	bot_emotion_representation: Optional[Tensor] = None
+	turn_metrics: Dict[str, Any] = field(default_factory=dict)
+	summary: str = ""
+	evicted_turns: List[Turn] = field(default_factory=list)
+	summarizing_turns: List[Turn] = field(default_factory=list)
+	num_turns_since_summary: int = 0
+	summary_future: Optional[Future] = None
+	system_message: Optional[Dict[str, Any]] = None
@@ -0,0 +1,221 @@
+import json
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+from torch import Tensor
+
+from emotion_chat_bot.session.ChatHistory import ChatHistory, Turn
+from emotion_chat_bot.session.ChatSession import ChatSession
+
+
+class SessionStore(ABC):
+	@abstractmethod
+	def get(self, session_id: str) -> Optional[ChatSession]:
+		pass
+
+	@abstractmethod
+	def put(self, session_id: str, session: ChatSession) -> None:
+		pass
+
+	@abstractmethod
+	def delete(self, session_id: str) -> None:
+		pass
+
+	def flush(self) -> None:
+		pass
+
+	def close(self) -> None:
+		self.flush()
+
+
+class InMemorySessionStore(SessionStore):
+	def __init__(self) -> None:
+		self.__sessions: Dict[str, ChatSession] = {}
+
+	def __len__(self) -> int:
+		return len(self.__sessions)
+
+	def get(self, session_id: str) -> Optional[ChatSession]:
+		return self.__sessions.get(session_id)
+
+	def put(self, session_id: str, session: ChatSession) -> None:
+		self.__sessions[session_id] = session
+
+	def delete(self, session_id: str) -> None:
+		self.__sessions.pop(session_id, None)
+
+
+def tensor_to_bytes(tensor: Optional[Tensor]) -> Optional[bytes]:
+	if tensor is None:
+		return None
+
+	return tensor.detach().to(device="cpu", dtype=torch.float32).numpy().tobytes()
+
+
+def bytes_to_tensor(data: Optional[bytes]) -> Optional[Tensor]:
+	if data is None:
+		return None
+
+	return torch.frombuffer(bytearray(data), dtype=torch.float32)
+
+
+schema_version: int = 2
+# statements upgrading the table to each version from the one before it
+schema_migrations: Dict[int, List[str]] = {
+	2: ["ALTER TABLE sessions ADD COLUMN evicted_turns TEXT NOT NULL DEFAULT '[]'"]
+}
+
+session_columns: List[str] = [
+	"session_id",
+	"history",
+	"summary",
+	"emotion_representation",
+	"bot_emotion_representation",
+	"evicted_turns",
+]
+SessionRow = Tuple[Any, ...]
+
+
+def session_to_row(session_id: str, session: ChatSession) -> SessionRow:
+	return (
+		session_id,
+		json.dumps(session.history.to_dict()),
+		session.summary,
+		tensor_to_bytes(session.emotion_representation),
+		tensor_to_bytes(session.bot_emotion_representation),
+		# turns still being summarized are kept too, the summary is redone for them after a restart
+		json.dumps([turn.to_list() for turn in session.summarizing_turns + session.evicted_turns]),
+	)
+
+
+class SQLiteSessionStore(SessionStore):
+	def __init__(self, path: str, max_cached_sessions: int = 4096, flush_interval: Optional[float] = 1.0) -> None:
+		if max_cached_sessions < 1:
+			raise ValueError("max_cached_sessions must be at least 1")
+
+		self.__max_cached_sessions: int = max_cached_sessions
+		self.__cached_sessions: OrderedDict[str, ChatSession] = OrderedDict()
+		self.__pending_rows: Dict[str, SessionRow] = {}
+		self.__lock: threading.RLock = threading.RLock()
+
+		self.__connection: sqlite3.Connection = sqlite3.connect(path, check_same_thread=False)
+		self.__connection.execute("PRAGMA journal_mode=WAL")
+		self.__migrate()
+
+		self.__stop_event: threading.Event = threading.Event()
+		self.__flush_thread: Optional[threading.Thread] = None
+		if flush_interval is not None:
+			self.__flush_thread = threading.Thread(
+				target=self.__flush_periodically, args=(flush_interval,), daemon=True
+			)
+			self.__flush_thread.start()
+
+	def __migrate(self) -> None:
+		version: int = self.__connection.execute("PRAGMA user_version").fetchone()[0]
+		if version > schema_version:
+			raise ValueError(f"session database schema version {version} is newer than supported ({schema_version})")
+
+		if version == 0:
+			# databases written before the schema was versioned already have the version 1 table
+			self.__connection.execute(
+				"CREATE TABLE IF NOT EXISTS sessions ("
+				"session_id TEXT PRIMARY KEY, "
+				"history TEXT NOT NULL, "
+				"summary TEXT NOT NULL, "
+				"emotion_representation BLOB NOT NULL, "
+				"bot_emotion_representation BLOB)"
+			)
+			version = 1
+		for target_version in range(version + 1, schema_version + 1):
+			for statement in schema_migrations[target_version]:
+				self.__connection.execute(statement)
+		self.__connection.execute(f"PRAGMA user_version = {schema_version}")
+		self.__connection.commit()
+
+	def __flush_periodically(self, flush_interval: float) -> None:
+		while not self.__stop_event.wait(flush_interval):
+			self.flush()
+
+	def __load(self, session_id: str) -> Optional[ChatSession]:
+		with self.__lock:
+			row = self.__connection.execute(
+				"SELECT history, summary, emotion_representation, bot_emotion_representation, evicted_turns "
+				"FROM sessions WHERE session_id = ?",
+				(session_id,),
+			).fetchone()
+		if row is None:
+			return None
+
+		return ChatSession(
+			history=ChatHistory.from_dict(json.loads(row[0])),
+			summary=row[1],
+			emotion_representation=bytes_to_tensor(row[2]),
+			bot_emotion_representation=bytes_to_tensor(row[3]),
+			evicted_turns=[Turn.from_list(turn_state) for turn_state in json.loads(row[4])],
+		)
+
+	def __write(self, rows: List[SessionRow]) -> None:
+		with self.__lock:
+			self.__connection.executemany(
+				f"INSERT OR REPLACE INTO sessions ({', '.join(session_columns)}) "
+				f"VALUES ({', '.join('?' for _ in session_columns)})",
+				rows,
+			)
+			self.__connection.commit()
+
+	def __cache(self, session_id: str, session: ChatSession) -> None:
+		self.__cached_sessions[session_id] = session
+		self.__cached_sessions.move_to_end(session_id)
+
+		while len(self.__cached_sessions) > self.__max_cached_sessions:
+			evicted_session_id, _ = self.__cached_sessions.popitem(last=False)
+			if evicted_session_id in self.__pending_rows:
+				self.__write([self.__pending_rows.pop(evicted_session_id)])
+
+	def get(self, session_id: str) -> Optional[ChatSession]:
+		with self.__lock:
+			session: Optional[ChatSession] = self.__cached_sessions.get(session_id)
+			if session is not None:
+				self.__cached_sessions.move_to_end(session_id)
+				return session
+
+			session = self.__load(session_id)
+			if session is not None:
+				self.__cache(session_id, session)
+
+			return session
+
+	def put(self, session_id: str, session: ChatSession) -> None:
+		# the session is serialized at the end of its turn, so flushes never read a session that is being updated
+		row: SessionRow = session_to_row(session_id, session)
+		with self.__lock:
+			self.__pending_rows[session_id] = row
+			self.__cache(session_id, session)
+
+	def delete(self, session_id: str) -> None:
+		with self.__lock:
+			self.__cached_sessions.pop(session_id, None)
+			self.__pending_rows.pop(session_id, None)
+			self.__connection.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+			self.__connection.commit()
+
+	def flush(self) -> None:
+		# the write stays under the lock, or an eviction in between could be overwritten by an older pending row
+		with self.__lock:
+			pending_rows: List[SessionRow] = list(self.__pending_rows.values())
+			self.__pending_rows.clear()
+			if len(pending_rows) != 0:
+				self.__write(pending_rows)
+
+	def close(self) -> None:
+		self.__stop_event.set()
+		if self.__flush_thread is not None:
+			self.__flush_thread.join()
+
+		self.flush()
+		with self.__lock:
+			self.__connection.close()
@@ -0,0 +1,31 @@
+import re
+from typing import Callable, List
+
+from emotion_chat_bot.session.ChatHistory import Turn
+
+Summarizer = Callable[[str, List[Turn]], str]
+
+
+class ExtractiveSummarizer:
+	def __init__(self, max_summary_length: int = 512) -> None:
+		if max_summary_length < 1:
+			raise ValueError("max_summary_length must be at least 1")
+
+		self.max_summary_length: int = max_summary_length
+
+	def __call__(self, summary: str, turns: List[Turn]) -> str:
+		sentences: List[str] = [sentence for sentence in re.split(r"(?<=[.!?])\s+", summary) if sentence != ""]
+		sentences.extend(
+			f"{turn.role} felt {turn.emotion}: {turn.dialog.strip()}" for turn in turns if turn.dialog.strip() != ""
+		)
+
+		# keep the most recent sentences that fit in the budget
+		kept_sentences: List[str] = []
+		length: int = 0
+		for sentence in reversed(sentences):
+			if length + len(sentence) + 1 > self.max_summary_length:
+				break
+			kept_sentences.append(sentence)
+			length += len(sentence) + 1
+
+		return " ".join(reversed(kept_sentences))
@@ -0,0 +1,111 @@
+import os
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, Dict, List, Optional, Tuple
+
+import torch
+from torch import Tensor
+
+
+class EmotionCompositionCache:
+	def __init__(self, max_size: int = 65536, ttl: Optional[float] = None, persistence_path: Optional[str] = None):
+		if max_size < 1:
+			raise ValueError("max_size must be at least 1")
+		if ttl is not None and ttl <= 0:
+			raise ValueError("ttl must be positive")
+
+		self.__max_size: int = max_size
+		self.__ttl: Optional[float] = ttl
+		self.__persistence_path: Optional[str] = persistence_path
+		self.__entries: OrderedDict[Tuple[str, str], Tuple[Tensor, float]] = OrderedDict()
+		self.__lock: Lock = Lock()
+		self.statistics: Dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+		if persistence_path is not None and os.path.exists(persistence_path):
+			self.load(persistence_path)
+
+	def __len__(self) -> int:
+		return len(self.__entries)
+
+	@property
+	def hit_rate(self) -> Optional[float]:
+		num_lookups: int = self.statistics["hits"] + self.statistics["misses"]
+		if num_lookups == 0:
+			return None
+
+		return self.statistics["hits"] / num_lookups
+
+	@staticmethod
+	def normalize(text: str) -> str:
+		return " ".join(text.split()).casefold()
+
+	def get(self, model_name: str, text: str) -> Optional[Tensor]:
+		key: Tuple[str, str] = (model_name, self.normalize(text))
+		with self.__lock:
+			entry: Optional[Tuple[Tensor, float]] = self.__entries.get(key)
+			if entry is not None and self.__ttl is not None and time.time() - entry[1] > self.__ttl:
+				del self.__entries[key]
+				self.statistics["expirations"] += 1
+				entry = None
+
+			if entry is None:
+				self.statistics["misses"] += 1
+				return None
+
+			self.__entries.move_to_end(key)
+			self.statistics["hits"] += 1
+
+			return entry[0]
+
+	def put(self, model_name: str, text: str, composition: Tensor) -> None:
+		key: Tuple[str, str] = (model_name, self.normalize(text))
+		with self.__lock:
+			self.__entries[key] = (composition.detach().cpu(), time.time())
+			self.__entries.move_to_end(key)
+			while len(self.__entries) > self.__max_size:
+				self.__entries.popitem(last=False)
+				self.statistics["evictions"] += 1
+
+	def classify(self, model_name: str, texts: List[str], classifier: Callable[[List[str]], Tensor]) -> Tensor:
+		# texts that normalize to the same key are looked up and classified once
+		unique_texts: Dict[str, str] = {}
+		for text in texts:
+			unique_texts.setdefault(self.normalize(text), text)
+
+		compositions: Dict[str, Optional[Tensor]] = {
+			key: self.get(model_name, text) for key, text in unique_texts.items()
+		}
+		missing_texts: Dict[str, str] = {key: text for key, text in unique_texts.items() if compositions[key] is None}
+
+		if len(missing_texts) != 0:
+			for (key, text), composition in zip(missing_texts.items(), classifier(list(missing_texts.values()))):
+				self.put(model_name, text, composition)
+				compositions[key] = composition
+
+		return torch.stack([compositions[self.normalize(text)].cpu() for text in texts])
+
+	@property
+	def persistence_path(self) -> Optional[str]:
+		return self.__persistence_path
+
+	def save(self, path: Optional[str] = None) -> None:
+		path = path if path is not None else self.__persistence_path
+		if path is None:
+			raise ValueError("path is not set")
+
+		with self.__lock:
+			torch.save(dict(self.__entries), path)
+
+	def load(self, path: Optional[str] = None) -> None:
+		path = path if path is not None else self.__persistence_path
+		if path is None:
+			raise ValueError("path is not set")
+
+		entries: Dict[Tuple[str, str], Tuple[Tensor, float]] = torch.load(path, weights_only=True)
+		with self.__lock:
+			for key, entry in entries.items():
+				if self.__ttl is None or time.time() - entry[1] <= self.__ttl:
+					self.__entries[key] = entry
+			while len(self.__entries) > self.__max_size:
+				self.__entries.popitem(last=False)
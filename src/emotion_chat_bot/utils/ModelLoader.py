@@ -0,0 +1,116 @@
+from typing import Literal
+
+import torch
+from transformers import (
+	AutoModelForCausalLM,
+	AutoModelForSequenceClassification,
+	AutoTokenizer,
+	PreTrainedModel,
+	TextClassificationPipeline,
+)
+
+from emotion_chat_bot.pipeline.ResponseGenerationPipeline import ResponseGeneratorPipeline
+
+try:
+	from unsloth import FastLanguageModel
+except (ImportError, NotImplementedError):
+	FastLanguageModel = None
+
+backends: list = ["cuda", "cpu"]
+cpu_precisions: list = ["fp32", "bf16", "int8"]
+
+
+def check_backend(backend: str, cpu_precision: str) -> None:
+	if backend not in backends:
+		raise ValueError(f"backend should be any of {', '.join(backends)}, your input is {backend}")
+	if cpu_precision not in cpu_precisions:
+		raise ValueError(f"cpu_precision should be any of {', '.join(cpu_precisions)}, your input is {cpu_precision}")
+	if backend == "cuda" and FastLanguageModel is None:
+		raise ImportError("the cuda backend needs unsloth, install the cuda extra or use the cpu backend")
+
+
+def prepare_cpu_model(model: PreTrainedModel, cpu_precision: Literal["fp32", "bf16", "int8"]) -> PreTrainedModel:
+	model.eval()
+	if cpu_precision == "int8":
+		return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+	return model
+
+
+def load_response_generator(
+	model_name: str, backend: Literal["cuda", "cpu"] = "cuda", cpu_precision: Literal["fp32", "bf16", "int8"] = "int8"
+) -> ResponseGeneratorPipeline:
+	check_backend(backend, cpu_precision)
+
+	if backend == "cuda":
+		model, tokenizer = FastLanguageModel.from_pretrained(
+			model_name=model_name,
+			attn_implementation="flash_attention_2",
+			pretraining_tp=1,
+			load_in_4bit=True,
+			device_map="auto",
+			low_cpu_mem_usage=True,
+			trust_remote_code=True,
+		)
+		FastLanguageModel.for_inference(model)
+	else:
+		model = AutoModelForCausalLM.from_pretrained(
+			model_name,
+			attn_implementation="sdpa",
+			torch_dtype=torch.bfloat16 if cpu_precision == "bf16" else torch.float32,
+			low_cpu_mem_usage=True,
+			trust_remote_code=True,
+		)
+		model = prepare_cpu_model(model, cpu_precision)
+		tokenizer = AutoTokenizer.from_pretrained(model_name, trust_remote_code=True)
+	tokenizer.padding_side = "left"
+	tokenizer.clean_up_tokenization_spaces = True
+
+	return ResponseGeneratorPipeline(
+		model,
+		tokenizer,
+		framework="pt",
+		task="conversation-generation",
+		num_workers=16,
+		torch_dtype="auto",
+		device="cpu" if backend == "cpu" else None,
+		add_special_tokens=True,
+		truncation=False,
+		padding=True,
+	)
+
+
+def load_text_classifier(
+	model_name: str, backend: Literal["cuda", "cpu"] = "cuda", cpu_precision: Literal["fp32", "bf16", "int8"] = "int8"
+) -> TextClassificationPipeline:
+	check_backend(backend, cpu_precision)
+
+	if backend == "cuda":
+		from transformers import BitsAndBytesConfig
+
+		model = AutoModelForSequenceClassification.from_pretrained(
+			model_name,
+			quantization_config=BitsAndBytesConfig(load_in_4bit=True, bnb_4bit_compute_dtype=torch.float16),
+			device_map="auto",
+			low_cpu_mem_usage=True,
+		)
+	else:
+		model = AutoModelForSequenceClassification.from_pretrained(
+			model_name,
+			attn_implementation="sdpa",
+			torch_dtype=torch.bfloat16 if cpu_precision == "bf16" else torch.float32,
+			low_cpu_mem_usage=True,
+		)
+		model = prepare_cpu_model(model, cpu_precision)
+
+	tokenizer = AutoTokenizer.from_pretrained(model_name, trust_remote_code=True)
+
+	return TextClassificationPipeline(
+		model=model,
+		tokenizer=tokenizer,
+		framework="pt",
+		task="sentiment-analysis",
+		num_workers=12,
+		torch_dtype="auto",
+		device="cpu" if backend == "cpu" else None,
+	)
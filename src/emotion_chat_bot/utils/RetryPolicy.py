@@ -0,0 +1,51 @@
+import copy
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from transformers import GenerationConfig
+
+from emotion_chat_bot.model.emotion_model.EmotionTransition import emotions
+
+
+@dataclass
+class RetryPolicy:
+	max_attempts: int = 3
+	deadline: Optional[float] = None
+	min_valid_candidates: int = 1
+	temperature: float = 0.7
+	temperature_step: float = 0.3
+	repetition_penalty_step: float = 0.1
+	fallback_emotion: str = "neutral"
+	fallback_response: str = "Sorry, I don't know what to say."
+
+	def __post_init__(self) -> None:
+		if self.max_attempts < 1:
+			raise ValueError("max_attempts must be at least 1")
+		if self.deadline is not None and self.deadline <= 0:
+			raise ValueError("deadline must be positive")
+		if not (1 <= self.min_valid_candidates <= 7):
+			raise ValueError("min_valid_candidates must between 1 and 7 (inclusive)")
+		if self.fallback_emotion not in emotions:
+			raise ValueError(f"fallback_emotion must be one of {emotions}")
+
+	def is_exhausted(self, num_attempts: int, start_time: float) -> bool:
+		if num_attempts == 0:
+			return False
+		if num_attempts >= self.max_attempts:
+			return True
+
+		return self.deadline is not None and (time.monotonic() - start_time) >= self.deadline
+
+	def escalate(self, generation_config: GenerationConfig, num_attempts: int) -> GenerationConfig:
+		if num_attempts == 0:
+			return generation_config
+
+		escalated_generation_config: GenerationConfig = copy.deepcopy(generation_config)
+		escalated_generation_config.do_sample = True
+		escalated_generation_config.temperature = self.temperature + self.temperature_step * (num_attempts - 1)
+		escalated_generation_config.repetition_penalty = (
+			generation_config.repetition_penalty or 1.0
+		) + self.repetition_penalty_step * num_attempts
+
+		return escalated_generation_config
@@ -23,9 +23,18 @@ while True:
 		print("Bot: Goodbye!")
 		break
 
-	result = bot(user_message)
-
-	print(f"Bot({result['emotion']}): {result['response']}")
+	streamed_text: str = ""
+	for event in bot.stream(user_message):
+		if "response" in event:
+			print()
+			# 串流的文字沒有通過檢查時，實際記錄的是候選回應
+			if event["response"] != streamed_text.strip():
+				print(f"Bot({event['emotion']}): {event['response']}")
+		elif "token" in event:
+			streamed_text += event["token"]
+			print(event["token"], end="", flush=True)
+		else:
+			print(f"Bot({event['emotion']}): ", end="", flush=True)
 
 emotions: list = ["neutral", "anger", "disgust", "fear", "happiness", "sadness", "surprise"]
 
@@ -1,18 +1,66 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from typing import Dict
 
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request
+from pydantic import BaseModel
 
 from emotion_chat_bot.EmotionChatBot import EmotionChatBot
+from emotion_chat_bot.service.RequestCoalescer import QueueFullError, RequestCoalescer
 
-# get, post, patch, delete
-service = FastAPI(title="Emotion-Chat-Bot")
+retry_after_seconds: int = 1
+
+
+class ChatInput(BaseModel):
+	session_id: str
+	message: str
+
+
+class ChatOutput(BaseModel):
+	session_id: str
+	emotion: str
+	response: str
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+	executor = ThreadPoolExecutor(max_workers=1)
+	app.state.bot = await asyncio.get_running_loop().run_in_executor(executor, EmotionChatBot)
+	app.state.coalescer = RequestCoalescer(app.state.bot, executor=executor)
+	app.state.coalescer.start()
 
+	yield
 
-@service.on_event("startup")
-def initialize_service():
-	bot = EmotionChatBot()
+	await app.state.coalescer.stop()
+	executor.shutdown(wait=True)
+	app.state.bot.session_store.close()
+	classification_cache = app.state.bot.classification_cache
+	if classification_cache is not None and classification_cache.persistence_path is not None:
+		classification_cache.save()
+
+
+# get, post, patch, delete
+service = FastAPI(title="Emotion-Chat-Bot", lifespan=lifespan)
 
 
 @service.get("/")
 def check_service_availability() -> Dict[str, bool]:
 	return {"servic_availability": True}
+
+
+@service.post("/chat")
+async def chat(chat_input: ChatInput, request: Request) -> ChatOutput:
+	try:
+		result: Dict[str, str] = await request.app.state.coalescer.submit(chat_input.session_id, chat_input.message)
+	except QueueFullError:
+		raise HTTPException(
+			status_code=503, detail="service is saturated", headers={"Retry-After": str(retry_after_seconds)}
+		)
+	except asyncio.TimeoutError:
+		# the coalescer drops a timed out message before it is stored, so retrying it is safe
+		raise HTTPException(
+			status_code=503, detail="request timed out", headers={"Retry-After": str(retry_after_seconds)}
+		)
+
+	return ChatOutput(session_id=chat_input.session_id, emotion=result["emotion"], response=result["response"])
@@ -0,0 +1,68 @@
+import time
+from argparse import ArgumentParser
+from typing import Callable
+
+import torch
+import wandb
+from torch import Tensor
+from transformers.hf_argparser import HfArgumentParser
+
+from emotion_chat_bot.model.emotion_model.EmotionModelKernel import EmotionModelKernel
+from emotion_chat_bot.model.emotion_model.EmotionTransition import EmotionModel, sample_dummy_representations
+from emotion_chat_bot.utils.CommonConfig import CommonScriptArguments, CommonWanDBArguments
+
+config_getter = ArgumentParser()
+config_getter.add_argument("--json_file", required=True, type=str)
+config = config_getter.parse_args()
+
+parser = HfArgumentParser((CommonScriptArguments, CommonWanDBArguments))
+args, wandb_args = parser.parse_json_file(config.json_file)
+
+run = wandb.init(
+	job_type=wandb_args.job_type,
+	config=wandb_args.config,
+	project=wandb_args.project,
+	group=wandb_args.group,
+	notes=wandb_args.notes,
+	mode=wandb_args.mode,
+	resume=wandb_args.resume,
+)
+torch.set_num_threads(run.config["num_threads"])
+
+model = EmotionModel.from_pretrained(run.config["emotion_model"]).eval()
+kernel = EmotionModelKernel.from_emotion_model(model)
+
+
+def sample_inputs(batch_size: int) -> (Tensor, Tensor):
+	representations: Tensor = sample_dummy_representations(torch.randint(0, 7, (batch_size,)))
+	compositions: Tensor = torch.randn((batch_size, 7)).softmax(-1)
+
+	return representations, compositions
+
+
+def measure_latency(function: Callable, *inputs) -> float:
+	function(*inputs)
+	start_time: float = time.perf_counter()
+	for _ in range(run.config["num_iterations"]):
+		function(*inputs)
+
+	return (time.perf_counter() - start_time) / run.config["num_iterations"] * 1e6
+
+
+results: list = []
+with torch.no_grad():
+	for batch_size in run.config["batch_sizes"]:
+		representations, compositions = sample_inputs(batch_size)
+		torch_latency: float = measure_latency(model.forward, representations, compositions)
+		numpy_latency: float = measure_latency(kernel.forward, representations.numpy(), compositions.numpy())
+
+		results.append([batch_size, torch_latency, numpy_latency, torch_latency / numpy_latency])
+		print(f"batch size {batch_size}: torch {torch_latency:.2f} us/call, numpy {numpy_latency:.2f} us/call")
+
+wandb.log({
+	"benchmark_result": wandb.Table(
+		columns=["batch_size", "torch_microseconds_per_call", "numpy_microseconds_per_call", "speedup"], data=results
+	)
+})
+
+wandb.finish()
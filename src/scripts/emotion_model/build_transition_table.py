@@ -0,0 +1,66 @@
+from argparse import ArgumentParser
+
+import torch
+import wandb
+from datasets import Dataset, load_dataset
+from datasets.load import DatasetDict
+from torch import Tensor
+from tqdm.auto import tqdm
+from transformers.hf_argparser import HfArgumentParser
+
+from emotion_chat_bot.model.emotion_model.EmotionTransitionTable import EmotionTransitionTable
+from emotion_chat_bot.utils.CommonConfig import CommonScriptArguments, CommonWanDBArguments
+from emotion_chat_bot.utils.CommonUtils import calculate_evaluation_result
+
+config_getter = ArgumentParser()
+config_getter.add_argument("--json_file", required=True, type=str)
+config = config_getter.parse_args()
+
+parser = HfArgumentParser((CommonScriptArguments, CommonWanDBArguments))
+args, wandb_args = parser.parse_json_file(config.json_file)
+
+run = wandb.init(
+	job_type=wandb_args.job_type,
+	config=wandb_args.config,
+	project=wandb_args.project,
+	group=wandb_args.group,
+	notes=wandb_args.notes,
+	mode=wandb_args.mode,
+	resume=wandb_args.resume,
+)
+
+# Load Dataset
+dataset: DatasetDict = load_dataset(run.config["dataset"], num_proc=16, keep_in_memory=True, trust_remote_code=True)
+
+
+def collect_transitions(split: Dataset) -> (Tensor, Tensor, Tensor):
+	# dialogs alternate user and bot, each bot emotion sits between two user compositions
+	user_emotion_compositions: list = []
+	bot_emotions: list = []
+	next_user_emotion_compositions: list = []
+	for sample in tqdm(split.with_format("torch"), colour="green"):
+		compositions: Tensor = sample["user_emotion_compositions"].reshape(-1, 7)
+		num_transitions: int = min(len(sample["bot_emotion"]), compositions.shape[0] - 1)
+		user_emotion_compositions.append(compositions[:num_transitions])
+		bot_emotions.append(sample["bot_emotion"][:num_transitions])
+		next_user_emotion_compositions.append(compositions[1 : num_transitions + 1])
+
+	return torch.cat(user_emotion_compositions), torch.cat(bot_emotions), torch.cat(next_user_emotion_compositions)
+
+
+table = EmotionTransitionTable().fit(*collect_transitions(dataset["train"]), smoothing=run.config["smoothing"])
+
+user_emotion_compositions, bot_emotions, next_user_emotion_compositions = collect_transitions(dataset["validation"])
+predictions: Tensor = table(user_emotion_compositions)[torch.arange(bot_emotions.shape[0]), bot_emotions]
+
+cross_entropy: float = -(next_user_emotion_compositions * predictions.clamp(min=1e-8).log()).sum(-1).mean().item()
+evaluation_result: dict = calculate_evaluation_result(predictions.argmax(-1), next_user_emotion_compositions.argmax(-1))
+wandb.log({
+	"val/cross_entropy": cross_entropy,
+	"val/f1_score": evaluation_result["f1_score"],
+	"val/accuracy": evaluation_result["accuracy"],
+})
+
+table.push_to_hub(run.config["trained_model_name"])
+
+wandb.finish()
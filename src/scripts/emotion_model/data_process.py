@@ -1,8 +1,10 @@
 from argparse import ArgumentParser
+from typing import List
 
+import numpy as np
 import torch
 import wandb
-from datasets import Array2D, ClassLabel, Sequence, load_dataset
+from datasets import Array2D, ClassLabel, DatasetDict, Sequence, load_dataset
 from transformers import (
 	AutoModelForSequenceClassification,
 	AutoTokenizer,
@@ -11,10 +13,7 @@ from transformers import (
 	pipeline,
 )
 
-from emotion_chat_bot.model.emotion_model.EmotionTransition import (
-	generate_dummy_representation,
-	get_emotion_composition,
-)
+from emotion_chat_bot.model.emotion_model.EmotionTransition import get_emotion_composition, sample_dummy_representations
 from emotion_chat_bot.utils.CommonConfig import CommonScriptArguments, CommonWanDBArguments
 
 config_getter = ArgumentParser()
@@ -56,11 +55,19 @@ dataset = dataset.map(
 
 dataset = dataset.filter(lambda sample: (len(sample["dialog"]) > 2) and (len(sample["emotion"]) > 2), num_proc=16)
 
-dataset = dataset.map(
-	lambda samples: {
-		"bot_initial_emotion_representation": [
-			generate_dummy_representation(sample[0]).unsqueeze(0) for sample in samples["emotion"]
-		],
+
+def batch_generator(split: str, first_index: int) -> torch.Generator:
+	# independent of the worker layout and different for every split, hash() is avoided as it is salted per process
+	seed_sequence = np.random.SeedSequence([run.config["seed"], int.from_bytes(split.encode(), "little"), first_index])
+
+	return torch.Generator().manual_seed(int(seed_sequence.generate_state(1, np.uint64)[0]))
+
+
+def split_turns(samples: dict, indices: List[int], split: str) -> dict:
+	return {
+		"bot_initial_emotion_representation": sample_dummy_representations(
+			torch.tensor([sample[0] for sample in samples["emotion"]]), batch_generator(split, indices[0])
+		).unsqueeze(1),
 		"bot_emotion": [
 			[emotion for i, emotion in enumerate(sample[1:]) if i % 2 == 1] for sample in samples["emotion"]
 		],
@@ -68,11 +75,20 @@ dataset = dataset.map(
 		"user_dialog": [
 			[emotion for i, emotion in enumerate(sample[1:]) if i % 2 == 0] for sample in samples["dialog"]
 		],
-	},
-	remove_columns=["emotion", "dialog"],
-	batched=True,
-	num_proc=16,
-)
+	}
+
+
+dataset = DatasetDict({
+	split: split_dataset.map(
+		split_turns,
+		with_indices=True,
+		fn_kwargs={"split": split},
+		remove_columns=["emotion", "dialog"],
+		batched=True,
+		num_proc=16,
+	)
+	for split, split_dataset in dataset.items()
+})
 
 dataset = dataset.cast_column("bot_initial_emotion_representation", Array2D((1, 7), "float32"))
 dataset = dataset.cast_column("bot_emotion", Sequence(ClassLabel(num_classes=7, names=emotion_labels)))
@@ -2,14 +2,17 @@ import json
 from argparse import ArgumentParser
 
 import torch
-import torch.nn.functional as f
 import wandb
 from datasets import load_dataset
 from torch import Tensor
 from torch.utils.data import DataLoader
 from tqdm.auto import tqdm
 
-from emotion_chat_bot.model.emotion_model.EmotionTransition import EmotionModel, representation_evolute
+from emotion_chat_bot.model.emotion_model.EmotionTransition import (
+	EmotionModel,
+	collate_emotion_transitions,
+	representation_evolute_batched,
+)
 from emotion_chat_bot.utils.CommonUtils import calculate_evaluation_result, get_torch_device, login_to_service
 
 
@@ -27,109 +30,77 @@ def sweep_function(config: dict = None) -> None:
 		attention=run.config["attention"], dropout=run.config["dropout"], bias=run.config["bias"], dtype=dtype
 	).to(device)
 
-	loss_function = torch.nn.CrossEntropyLoss()
+	loss_function = torch.nn.CrossEntropyLoss(ignore_index=-100)
 	optimizer = eval(f"torch.optim.{run.config['optimizer']}")(model.parameters(), lr=run.config["learning_rate"])
 
-	train_dataloader = DataLoader(
-		dataset["train"].with_format("torch"),
-		batch_size=1,
-		shuffle=True,
-		num_workers=12,
-		pin_memory=True,
-		pin_memory_device=device,
-	)
-	validation_dataloader = DataLoader(
-		dataset["validation"].with_format("torch"),
-		batch_size=1,
-		shuffle=True,
-		num_workers=12,
-		pin_memory=True,
-		pin_memory_device=device,
-	)
+	def create_dataloader(split: str, shuffle: bool) -> DataLoader:
+		return DataLoader(
+			dataset[split].with_format("torch"),
+			batch_size=run.config["batch_size"],
+			shuffle=shuffle,
+			collate_fn=collate_emotion_transitions,
+			num_workers=12,
+			pin_memory=True,
+			pin_memory_device=device,
+		)
+
+	def evolute(batch: dict) -> Tensor:
+		return representation_evolute_batched(
+			model, batch["bot_initial_emotion_representation"], batch["user_emotion_compositions"], batch["mask"]
+		).float()
+
+	train_dataloader = create_dataloader("train", shuffle=True)
+	validation_dataloader = create_dataloader("validation", shuffle=False)
 	for i in range(run.config["num_epochs"]):
-		running_loss: float = 0
+		running_loss: Tensor = torch.zeros((), device=device)
 		model.train()
-		for sample in tqdm(train_dataloader, colour="green"):
-			representations: list = [sample["bot_initial_emotion_representation"][0].to(device)]
-			compositions: list = [
-				emotion.transpose(1, 0) for emotion in sample["user_emotion_compositions"][0].to(device)
-			]
-			labels: Tensor = f.one_hot(sample["bot_emotion"][0], 7).float().to(device)
+		for batch in tqdm(train_dataloader, colour="green"):
+			batch = {key: value.to(device) for key, value in batch.items()}
 
 			optimizer.zero_grad()
 
-			outputs: Tensor = (
-				torch.stack(representation_evolute(model, representations, compositions)[1:], dim=1)[0]
-				.float()
-				.to(device)
-			)
-
-			loss = loss_function(outputs, labels)
-			wandb.log({"train/loss": loss.item()})
-			running_loss += loss.item()
+			# (B, T, 7) -> (B, 7, T), padded turns are ignored by the loss
+			loss = loss_function(evolute(batch).transpose(1, 2), batch["bot_emotion"])
+			running_loss += loss.detach()
 
 			loss.backward()
 			optimizer.step()
 
 		if i + 1 == run.config["num_epochs"]:
-			wandb.log({"train/train_loss": running_loss / len(train_dataloader)})
+			wandb.log({"train/train_loss": running_loss.item() / len(train_dataloader)})
 
-		running_loss = 0
+		running_loss = torch.zeros((), device=device)
 		truths: list = []
 		predictions: list = []
 		model.eval()
 		with torch.no_grad():
-			for sample in tqdm(validation_dataloader, colour="blue"):
-				representations: list = [sample["bot_initial_emotion_representation"][0].to(device)]
-				compositions: list = [
-					emotion.transpose(1, 0) for emotion in sample["user_emotion_compositions"][0].to(device)
-				]
-				labels: Tensor = f.one_hot(sample["bot_emotion"][0], 7).float().to(device)
-
-				outputs: Tensor = (
-					torch.stack(representation_evolute(model, representations, compositions)[1:], dim=1)[0]
-					.float()
-					.to(device)
-				)
-
-				loss = loss_function(outputs, labels)
-				wandb.log({"val/loss": loss.item()})
-				running_loss += loss.item()
-				truths += sample["bot_emotion"].tolist()[0]
-				predictions += torch.argmax(outputs, dim=1).tolist()
-
-			wandb.log({"val/loss": running_loss / len(validation_dataloader)})
-			evaluation_result: dict = calculate_evaluation_result(torch.tensor(predictions), torch.tensor(truths))
+			for batch in tqdm(validation_dataloader, colour="blue"):
+				batch = {key: value.to(device) for key, value in batch.items()}
+
+				outputs: Tensor = evolute(batch)
+
+				running_loss += loss_function(outputs.transpose(1, 2), batch["bot_emotion"])
+				truths.append(batch["bot_emotion"][batch["mask"]])
+				predictions.append(outputs.argmax(-1)[batch["mask"]])
+
+			wandb.log({"val/loss": running_loss.item() / len(validation_dataloader)})
+			evaluation_result: dict = calculate_evaluation_result(torch.cat(predictions).cpu(), torch.cat(truths).cpu())
 			wandb.log({"val/f1_score": evaluation_result["f1_score"], "val/accuracy": evaluation_result["accuracy"]})
 
 	model.eval()
 	model = torch.compile(model)
 
-	eval_dataset = dataset["test"].map(
-		lambda samples: {
-			"bot_emotion_representations": [
-				representation_evolute(
-					model,
-					[torch.tensor(sample[0][0]).to(device)],
-					[torch.tensor(emotion).to(device) for emotion in sample[1]],
-				)[1:]
-				for sample in zip(samples["bot_initial_emotion_representation"], samples["user_emotion_compositions"])
-			]
-		},
-		batched=True,
-	)
+	eval_truths: list = []
+	eval_predictions: list = []
+	with torch.no_grad():
+		for batch in tqdm(create_dataloader("test", shuffle=False), colour="blue"):
+			batch = {key: value.to(device) for key, value in batch.items()}
+			eval_truths.append(batch["bot_emotion"][batch["mask"]])
+			eval_predictions.append(evolute(batch).argmax(-1)[batch["mask"]])
 
-	eval_dataset = eval_dataset.map(
-		lambda samples: {"bot_possible_emotion": [torch.tensor(sample).argmax(1) for sample in samples]},
-		input_columns="bot_emotion_representations",
-		batched=True,
-		num_proc=16,
+	evaluation_result: dict = calculate_evaluation_result(
+		torch.cat(eval_predictions).cpu(), torch.cat(eval_truths).cpu()
 	)
-
-	eval_predictions: Tensor = torch.cat([torch.tensor(turn) for turn in eval_dataset["bot_possible_emotion"]])
-	eval_truths: Tensor = torch.cat([torch.tensor(turn) for turn in eval_dataset["bot_emotion"]])
-
-	evaluation_result: dict = calculate_evaluation_result(eval_predictions, eval_truths)
 	wandb.log({
 		"eval/f1-score": evaluation_result["f1_score"],
 		"eval/accuracy": evaluation_result["accuracy"],
@@ -1,7 +1,6 @@
 from argparse import ArgumentParser
 
 import torch
-import torch.nn.functional as f
 import wandb
 from datasets import load_dataset
 from datasets.load import DatasetDict
@@ -10,7 +9,11 @@ from torch.utils.data import DataLoader
 from tqdm.auto import tqdm
 from transformers.hf_argparser import HfArgumentParser
 
-from emotion_chat_bot.model.emotion_model.EmotionTransition import EmotionModel, representation_evolute
+from emotion_chat_bot.model.emotion_model.EmotionTransition import (
+	EmotionModel,
+	collate_emotion_transitions,
+	representation_evolute_batched,
+)
 from emotion_chat_bot.utils.CommonConfig import CommonScriptArguments, CommonWanDBArguments
 from emotion_chat_bot.utils.CommonUtils import calculate_evaluation_result, get_torch_device
 
@@ -37,75 +40,67 @@ dataset: DatasetDict = load_dataset(run.config["dataset"], num_proc=16, keep_in_
 
 model = EmotionModel().to(device)
 
-loss_function = torch.nn.CrossEntropyLoss()
+loss_function = torch.nn.CrossEntropyLoss(ignore_index=-100)
 optimizer = torch.optim.Adam(model.parameters(), lr=run.config["learning_rate"])
 
 train_dataloader = DataLoader(
 	dataset["train"].with_format("torch"),
-	batch_size=1,
+	batch_size=run.config["batch_size"],
 	shuffle=True,
+	collate_fn=collate_emotion_transitions,
 	num_workers=12,
 	pin_memory=True,
 	pin_memory_device=device,
 )
 validation_dataloader = DataLoader(
 	dataset["validation"].with_format("torch"),
-	batch_size=1,
-	shuffle=True,
+	batch_size=run.config["batch_size"],
+	shuffle=False,
+	collate_fn=collate_emotion_transitions,
 	num_workers=12,
 	pin_memory=True,
 	pin_memory_device=device,
 )
 for i in range(run.config["num_epochs"]):
-	running_loss: float = 0
+	running_loss: Tensor = torch.zeros((), device=device)
 	model.train()
-	for sample in tqdm(train_dataloader, colour="green"):
-		representations: list = [sample["bot_initial_emotion_representation"][0].to(device)]
-		compositions: list = [emotion.transpose(1, 0) for emotion in sample["user_emotion_compositions"][0].to(device)]
-		labels: Tensor = f.one_hot(sample["bot_emotion"][0], 7).float().to(device)
+	for batch in tqdm(train_dataloader, colour="green"):
+		batch = {key: value.to(device) for key, value in batch.items()}
 
 		optimizer.zero_grad()
 
-		outputs: Tensor = (
-			torch.stack(representation_evolute(model, representations, compositions)[1:], dim=1)[0].float().to(device)
-		)
+		outputs: Tensor = representation_evolute_batched(
+			model, batch["bot_initial_emotion_representation"], batch["user_emotion_compositions"], batch["mask"]
+		).float()
 
-		loss = loss_function(outputs, labels)
-		wandb.log({"train/loss": loss.item()})
-		running_loss += loss.item()
+		# (B, T, 7) -> (B, 7, T), padded turns are ignored by the loss
+		loss = loss_function(outputs.transpose(1, 2), batch["bot_emotion"])
+		running_loss += loss.detach()
 
 		loss.backward()
 		optimizer.step()
 
 	if i + 1 == run.config["num_epochs"]:
-		wandb.log({"train/train_loss": running_loss / len(train_dataloader)})
+		wandb.log({"train/train_loss": running_loss.item() / len(train_dataloader)})
 
-	running_loss = 0
+	running_loss = torch.zeros((), device=device)
 	truths: list = []
 	predictions: list = []
 	model.eval()
 	with torch.no_grad():
-		for sample in tqdm(validation_dataloader, colour="blue"):
-			representations: list = [sample["bot_initial_emotion_representation"][0].to(device)]
-			compositions: list = [
-				emotion.transpose(1, 0) for emotion in sample["user_emotion_compositions"][0].to(device)
-			]
-			labels: Tensor = f.one_hot(sample["bot_emotion"][0], 7).float().to(device)
-
-			outputs: Tensor = (
-				torch.stack(representation_evolute(model, representations, compositions)[1:], dim=1)[0]
-				.float()
-				.to(device)
-			)
-
-			loss = loss_function(outputs, labels)
-			wandb.log({"val/loss": loss.item()})
-			running_loss += loss.item()
-			truths += sample["bot_emotion"].tolist()[0]
-			predictions += torch.argmax(outputs, dim=1).tolist()
-
-		wandb.log({"val/loss": running_loss / len(validation_dataloader)})
-		evaluation_result: dict = calculate_evaluation_result(torch.tensor(predictions), torch.tensor(truths))
+		for batch in tqdm(validation_dataloader, colour="blue"):
+			batch = {key: value.to(device) for key, value in batch.items()}
+
+			outputs: Tensor = representation_evolute_batched(
+				model, batch["bot_initial_emotion_representation"], batch["user_emotion_compositions"], batch["mask"]
+			).float()
+
+			running_loss += loss_function(outputs.transpose(1, 2), batch["bot_emotion"])
+			truths.append(batch["bot_emotion"][batch["mask"]])
+			predictions.append(outputs.argmax(-1)[batch["mask"]])
+
+		wandb.log({"val/loss": running_loss.item() / len(validation_dataloader)})
+		evaluation_result: dict = calculate_evaluation_result(torch.cat(predictions).cpu(), torch.cat(truths).cpu())
 		wandb.log({"val/f1_score": evaluation_result["f1_score"], "val/accuracy": evaluation_result["accuracy"]})
 
 model = torch.compile(model)
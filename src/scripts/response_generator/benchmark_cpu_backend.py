@@ -0,0 +1,79 @@
+import time
+from argparse import ArgumentParser
+
+import torch
+import wandb
+from datasets import load_dataset
+from transformers import GenerationConfig, HfArgumentParser
+
+from emotion_chat_bot.utils.CommonConfig import CommonScriptArguments, CommonWanDBArguments
+from emotion_chat_bot.utils.ModelLoader import load_response_generator, load_text_classifier
+
+config_getter = ArgumentParser()
+config_getter.add_argument("--json_file", required=True, type=str)
+config = config_getter.parse_args()
+
+parser = HfArgumentParser((CommonScriptArguments, CommonWanDBArguments))
+args, wandb_args = parser.parse_json_file(config.json_file)
+
+run = wandb.init(
+	job_type=wandb_args.job_type,
+	config=wandb_args.config,
+	project=wandb_args.project,
+	group=wandb_args.group,
+	notes=wandb_args.notes,
+	mode=wandb_args.mode,
+	resume=wandb_args.resume,
+)
+torch.set_num_threads(run.config["num_threads"])
+
+dataset = load_dataset(run.config["dataset"], split="test", num_proc=16, trust_remote_code=True)
+dataset = dataset.take(run.config["num_samples"])
+
+system_prompt: list = [{"role": "system", "content": {"emotion": "", "dialog": run.config["system_prompt"]}}]
+chats: list = [system_prompt + sample for sample in dataset["prompt"]]
+texts: list = [chat[-2]["content"]["dialog"] for chat in chats]
+
+generation_config = GenerationConfig(
+	max_new_tokens=run.config["max_new_tokens"],
+	min_new_tokens=run.config["max_new_tokens"],
+	repetition_penalty=run.config["repetition_penalty"],
+)
+
+results: list = []
+for cpu_precision in ["fp32", run.config["cpu_precision"]]:
+	response_generator = load_response_generator(run.config["response_generator_model"], "cpu", cpu_precision)
+	generation_config.pad_token_id = response_generator.tokenizer.pad_token_id
+	generation_config.eos_token_id = response_generator.tokenizer.eos_token_id
+
+	# warm up
+	response_generator(chats[: run.config["batch_size"]], generation_config=generation_config)
+	start_time: float = time.perf_counter()
+	response_generator(chats, generation_config=generation_config, batch_size=run.config["batch_size"])
+	generation_time: float = time.perf_counter() - start_time
+
+	text_classifier = load_text_classifier(run.config["sentiment_analysis_model"], "cpu", cpu_precision)
+
+	text_classifier(texts[: run.config["batch_size"]])
+	start_time = time.perf_counter()
+	text_classifier(texts, batch_size=run.config["batch_size"])
+	classification_time: float = time.perf_counter() - start_time
+
+	results.append([
+		cpu_precision,
+		len(chats) * run.config["max_new_tokens"] / generation_time,
+		len(texts) / classification_time,
+	])
+	print(f"{cpu_precision}: {results[-1][1]:.2f} generated tokens/s, {results[-1][2]:.2f} classified texts/s")
+
+	del response_generator, text_classifier
+
+wandb.log({
+	"benchmark_result": wandb.Table(
+		columns=["cpu_precision", "generated_tokens_per_second", "classified_texts_per_second"], data=results
+	),
+	"generation_speedup": results[1][1] / results[0][1],
+	"classification_speedup": results[1][2] / results[0][2],
+})
+
+wandb.finish()
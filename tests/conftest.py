@@ -0,0 +1,71 @@
+import json
+import string
+from pathlib import Path
+from typing import Callable, List
+
+import pytest
+import torch
+from tokenizers import Tokenizer, decoders, models, normalizers, pre_tokenizers, trainers
+from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+
+from emotion_chat_bot.pipeline.ResponseGenerationPipeline import ResponseGeneratorPipeline
+
+chat_template_path: Path = (
+	Path(__file__).parents[1] / "src" / "scripts" / "response_generator" / "chat_templates" / "Llama2_OUT_INST_UNI.json"
+)
+corpus: List[str] = [
+	"Hi, how are you? I am fine, thanks. Not so good today... You are a chat bot.",
+	"neutral anger disgust fear happiness sadness surprise",
+	"<<SYS>>\n\n<</SYS>>\n",
+]
+
+
+def build_tokenizer(legacy: bool) -> PreTrainedTokenizerFast:
+	tokenizer = Tokenizer(models.BPE(unk_token="<unk>"))
+	if legacy:
+		# like the legacy Llama tokenizer, every encoded text gets a leading space
+		tokenizer.normalizer = normalizers.Sequence([normalizers.Prepend("▁"), normalizers.Replace(" ", "▁")])
+	else:
+		tokenizer.pre_tokenizer = pre_tokenizers.Metaspace(prepend_scheme="never")
+	tokenizer.decoder = decoders.Metaspace(prepend_scheme="never")
+	tokenizer.train_from_iterator(
+		corpus * 4,
+		trainers.BpeTrainer(
+			vocab_size=300,
+			special_tokens=["<unk>", "<s>", "</s>"],
+			initial_alphabet=list(string.ascii_letters + string.digits + string.punctuation + "\n▁"),
+			show_progress=False,
+		),
+	)
+
+	template: dict = json.loads(chat_template_path.read_text(encoding="utf-8"))
+	pretrained_tokenizer = PreTrainedTokenizerFast(
+		tokenizer_object=tokenizer, bos_token="<s>", eos_token="</s>", unk_token="<unk>"
+	)
+	pretrained_tokenizer.add_special_tokens(template["special_tokens"])
+	pretrained_tokenizer.chat_template = template["template"]
+
+	return pretrained_tokenizer
+
+
+def build_response_generator(legacy: bool = False) -> ResponseGeneratorPipeline:
+	tokenizer: PreTrainedTokenizerFast = build_tokenizer(legacy)
+	torch.manual_seed(0)
+	model = LlamaForCausalLM(
+		LlamaConfig(
+			vocab_size=len(tokenizer),
+			hidden_size=8,
+			intermediate_size=16,
+			num_hidden_layers=1,
+			num_attention_heads=1,
+			num_key_value_heads=1,
+		)
+	).eval()
+
+	return ResponseGeneratorPipeline(model=model, tokenizer=tokenizer, device="cpu")
+
+
+@pytest.fixture
+def response_generator_factory() -> Callable[..., ResponseGeneratorPipeline]:
+	# a tiny randomly initialized Llama with the sft chat template, built offline
+	return build_response_generator
@@ -0,0 +1,42 @@
+from typing import List
+
+import torch
+from torch import Tensor
+
+from emotion_chat_bot.utils.CompositionCache import EmotionCompositionCache
+
+
+class CountingClassifier:
+	def __init__(self) -> None:
+		self.calls: List[List[str]] = []
+
+	def __call__(self, texts: List[str]) -> Tensor:
+		self.calls.append(texts)
+
+		return torch.stack([torch.full((7,), float(len(text))) for text in texts])
+
+
+def test_duplicate_texts_are_classified_and_counted_once() -> None:
+	cache = EmotionCompositionCache()
+	classifier = CountingClassifier()
+
+	compositions: Tensor = cache.classify("model", ["Hi.", " hi. ", "Hello.", "Hi."], classifier)
+
+	assert classifier.calls == [["Hi.", "Hello."]]
+	assert cache.statistics["misses"] == 2
+	torch.testing.assert_close(compositions[0], compositions[1])
+	torch.testing.assert_close(compositions[0], compositions[3])
+
+	cache.classify("model", ["HI.", "Hello."], classifier)
+	assert len(classifier.calls) == 1
+	assert cache.statistics["hits"] == 2
+
+
+def test_save_and_load(tmp_path) -> None:
+	path: str = str(tmp_path / "cache.pt")
+	cache = EmotionCompositionCache(persistence_path=path)
+	cache.classify("model", ["Hi."], CountingClassifier())
+	cache.save()
+
+	restored_cache = EmotionCompositionCache(persistence_path=path)
+	torch.testing.assert_close(restored_cache.get("model", "Hi."), torch.full((7,), 3.0))
@@ -0,0 +1,206 @@
+from typing import Any, Callable, Dict, List
+
+import pytest
+import torch
+from transformers import GenerationConfig
+
+from emotion_chat_bot.EmotionChatBot import EmotionChatBot
+from emotion_chat_bot.model.emotion_model.EmotionTrajectoryPlanner import EmotionTrajectoryPlanner
+from emotion_chat_bot.model.emotion_model.EmotionTransition import EmotionModel, emotions
+from emotion_chat_bot.model.emotion_model.EmotionTransitionTable import EmotionTransitionTable
+from emotion_chat_bot.pipeline.ResponseGenerationPipeline import ResponseGeneratorPipeline
+
+session_ids: List[str] = ["a", "b", "c"]
+bot_options: Dict[str, Dict[str, Any]] = {
+	"regenerate": {},
+	"incremental": {"incremental_tokenization": True},
+	"prefix": {"prefix_caching": True},
+	"incremental_prefix": {"incremental_tokenization": True, "prefix_caching": True},
+	"candidate": {"response_selection": "candidate"},
+	# the legacy template cannot be tokenized per turn, so the context window measures whole prompts
+	"incremental_fallback": {"incremental_tokenization": True, "max_context_tokens": 96},
+}
+
+
+class StubClassifier:
+	def __init__(self, num_failures: int = 0) -> None:
+		self.num_failures: int = num_failures
+
+	def __call__(self, texts: List[str], return_all_scores: bool = True, batch_size: int = 1) -> List[list]:
+		if self.num_failures != 0:
+			self.num_failures -= 1
+			raise RuntimeError("out of memory")
+
+		return [
+			[{"label": emotion, "score": ((len(text) + 3 * i) % 7) / 7} for i, emotion in enumerate(emotions)]
+			for text in texts
+		]
+
+
+def create_bot(
+	response_generator: ResponseGeneratorPipeline, emotion_predictor: StubClassifier, **kwargs
+) -> EmotionChatBot:
+	torch.manual_seed(0)
+	bot = EmotionChatBot(
+		system_prompt="You are a chat bot.", backend="cpu", cpu_precision="fp32", lazy_loading=True, **kwargs
+	)
+	# the components are replaced before their first use, so nothing is downloaded
+	bot._EmotionChatBot__components.update({
+		"response_generator": response_generator,
+		"sentiment_analyzer": StubClassifier(),
+		"emotion_predictor": emotion_predictor,
+		"emotion_model": EmotionModel().eval(),
+	})
+
+	return bot
+
+
+def create_generation_config(response_generator: ResponseGeneratorPipeline) -> GenerationConfig:
+	return GenerationConfig(
+		max_new_tokens=4,
+		min_new_tokens=4,
+		do_sample=False,
+		repetition_penalty=1.0,
+		pad_token_id=response_generator.tokenizer.pad_token_id,
+		eos_token_id=response_generator.tokenizer.eos_token_id,
+	)
+
+
+def roles(bot: EmotionChatBot, session_id: str) -> List[str]:
+	return [turn.role for turn in bot.session_store.get(session_id).history]
+
+
+@pytest.mark.parametrize("options", bot_options.values(), ids=bot_options.keys())
+def test_failed_turn_leaves_sessions_usable(
+	response_generator_factory: Callable[..., ResponseGeneratorPipeline], options: Dict[str, Any]
+) -> None:
+	response_generator: ResponseGeneratorPipeline = response_generator_factory(legacy="max_context_tokens" in options)
+	bot: EmotionChatBot = create_bot(response_generator, StubClassifier(num_failures=1), **options)
+	generation_config: GenerationConfig = create_generation_config(response_generator)
+
+	with pytest.raises(RuntimeError):
+		bot.chat_batch(session_ids, ["Hi.", "How are you?", "Not so good."], generation_config)
+	assert all(roles(bot, session_id) == [] for session_id in session_ids)
+
+	for user_messages in [["Hi.", "How are you?", "Not so good."], ["Thanks!", "Fine.", "Why?"]]:
+		results: List[Dict[str, str]] = bot.chat_batch(session_ids, user_messages, generation_config)
+		assert all(result["emotion"] in emotions for result in results)
+
+	assert all(roles(bot, session_id) == ["user", "bot", "user", "bot"] for session_id in session_ids)
+
+
+@pytest.mark.parametrize("response_selection", ["regenerate", "candidate"])
+def test_stream_closed_early_leaves_session_usable(
+	response_generator_factory: Callable[..., ResponseGeneratorPipeline], response_selection: str
+) -> None:
+	response_generator: ResponseGeneratorPipeline = response_generator_factory()
+	bot: EmotionChatBot = create_bot(response_generator, StubClassifier(), response_selection=response_selection)
+	generation_config: GenerationConfig = create_generation_config(response_generator)
+
+	events = bot.stream("Hi.", generation_config, session_id="a")
+	assert "emotion" in next(events)
+	events.close()
+	assert roles(bot, "a") == []
+
+	bot("How are you?", generation_config, session_id="a")
+	events: list = list(bot.stream("Fine.", generation_config, session_id="a"))
+	assert events[-1]["response"] == bot.session_store.get("a").history[-1].dialog
+	assert roles(bot, "a") == ["user", "bot", "user", "bot"]
+
+
+def test_stream_raises_generation_errors(
+	response_generator_factory: Callable[..., ResponseGeneratorPipeline], monkeypatch: pytest.MonkeyPatch
+) -> None:
+	response_generator: ResponseGeneratorPipeline = response_generator_factory()
+	bot: EmotionChatBot = create_bot(response_generator, StubClassifier())
+
+	events = bot.stream("Hi.", create_generation_config(response_generator), session_id="a")
+	next(events)
+
+	def fail(*args, **kwargs) -> None:
+		raise RuntimeError("out of memory")
+
+	# the streamer would wait forever for tokens from a failed generation
+	monkeypatch.setattr("emotion_chat_bot.EmotionChatBot.streamer_poll_interval", 0.05)
+	monkeypatch.setattr(response_generator.model, "generate", fail)
+	with pytest.raises(RuntimeError):
+		next(events)
+	assert roles(bot, "a") == []
+
+
+def test_abandoned_turn_is_not_stored(response_generator_factory: Callable[..., ResponseGeneratorPipeline]) -> None:
+	response_generator: ResponseGeneratorPipeline = response_generator_factory()
+	bot: EmotionChatBot = create_bot(response_generator, StubClassifier())
+
+	bot.chat_batch(
+		session_ids,
+		["Hi.", "How are you?", "Not so good."],
+		create_generation_config(response_generator),
+		0,
+		lambda i: i != 1,
+	)
+
+	assert [roles(bot, session_id) for session_id in session_ids] == [["user", "bot"], [], ["user", "bot"]]
+
+
+def test_context_window_fallback_fits_every_prompt(
+	response_generator_factory: Callable[..., ResponseGeneratorPipeline], monkeypatch: pytest.MonkeyPatch
+) -> None:
+	response_generator: ResponseGeneratorPipeline = response_generator_factory(legacy=True)
+	bot: EmotionChatBot = create_bot(
+		response_generator, StubClassifier(), incremental_tokenization=True, max_context_tokens=64
+	)
+	generation_config: GenerationConfig = create_generation_config(response_generator)
+	generate_from_ids: Callable[..., List[str]] = response_generator.generate_from_ids
+	prompt_lengths: List[int] = []
+
+	def record_prompt_lengths(prompts_ids: List[List[int]], *args, **kwargs) -> List[str]:
+		prompt_lengths.extend(len(prompt_ids) for prompt_ids in prompts_ids)
+		return generate_from_ids(prompts_ids, *args, **kwargs)
+
+	monkeypatch.setattr(response_generator, "generate_from_ids", record_prompt_lengths)
+	for user_message in ["Hi.", "How are you?", "Not so good.", "Why?"]:
+		bot(user_message, generation_config, session_id="a")
+
+	assert len(bot.session_store.get("a").history) < 8
+	assert max(prompt_lengths) <= 64
+
+
+def test_planner_rank_one_is_the_selected_emotion(
+	response_generator_factory: Callable[..., ResponseGeneratorPipeline], monkeypatch: pytest.MonkeyPatch
+) -> None:
+	# with every emotion ranked and the table as the reaction model, both score the same future representations
+	bot: EmotionChatBot = create_bot(
+		response_generator_factory(),
+		StubClassifier(),
+		response_selection="candidate",
+		lookahead_top_k=7,
+		transition_table_model_name="transition-table",
+		predictor_refinement_weight=0,
+	)
+	transition_table = EmotionTransitionTable()
+	transition_table.transition_table.copy_(
+		torch.randn(7, 7, 7, generator=torch.Generator().manual_seed(2)).softmax(-1)
+	)
+	bot._EmotionChatBot__components["transition_table"] = transition_table
+
+	monkeypatch.setattr(
+		bot,
+		"_EmotionChatBot__generate_candidate_responses",
+		lambda sessions, candidates_emotions, generation_config: [
+			{emotion: "Okay." for emotion in candidate_emotions} for candidate_emotions in candidates_emotions
+		],
+	)
+	planner_call: Callable[..., List[List[str]]] = EmotionTrajectoryPlanner.__call__
+	rankings: List[List[str]] = []
+
+	def record_rankings(*args) -> List[List[str]]:
+		rankings.extend(planner_call(*args))
+		return rankings
+
+	monkeypatch.setattr(EmotionTrajectoryPlanner, "__call__", record_rankings)
+	results: List[Dict[str, str]] = bot.chat_batch(
+		session_ids, ["Hi.", "How are you?", "Not so good."], create_generation_config(bot.response_generator)
+	)
+
+	assert [result["emotion"] for result in results] == [ranking[0] for ranking in rankings]
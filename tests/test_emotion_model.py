@@ -0,0 +1,56 @@
+import pytest
+import torch
+from torch import Tensor
+
+from emotion_chat_bot.model.emotion_model.EmotionTransition import EmotionModel
+
+
+def baseline_forward(model: EmotionModel, representation: Tensor, input_emotion: Tensor) -> Tensor:
+	# the unbatched forward the batched one replaced
+	state_dict: dict = model.state_dict()
+	weight: Tensor = state_dict["_EmotionModel__weight_D.weight"]
+	bias: Tensor = state_dict.get("_EmotionModel__weight_D.bias")
+
+	raw_attention: Tensor = input_emotion.matmul(representation.squeeze().diag())
+	attention_score: Tensor = raw_attention.softmax(-1).squeeze().diag()
+	difference: Tensor = torch.clamp(
+		torch.diagonal(torch.nn.functional.linear(attention_score**3, weight, bias)), -1, 1
+	)
+
+	return representation + difference
+
+
+@pytest.fixture(params=[False, True], ids=["no_bias", "bias"])
+def model(request) -> EmotionModel:
+	torch.manual_seed(0)
+
+	return EmotionModel(bias=request.param).eval()
+
+
+@pytest.mark.parametrize(
+	("representation_shape", "input_emotion_shape"), [((7,), (7,)), ((7,), (1, 7)), ((1, 7), (1, 7))]
+)
+def test_forward_matches_baseline(model: EmotionModel, representation_shape: tuple, input_emotion_shape: tuple) -> None:
+	representation: Tensor = torch.rand(representation_shape) * 2 - 1
+	input_emotion: Tensor = torch.randn(input_emotion_shape).softmax(-1)
+
+	with torch.no_grad():
+		output: Tensor = model(representation, input_emotion)
+		expected: Tensor = baseline_forward(model, representation, input_emotion)
+
+	assert output.shape == expected.shape
+	torch.testing.assert_close(output, expected)
+
+
+def test_batched_forward_matches_rows(model: EmotionModel) -> None:
+	representations: Tensor = torch.rand((16, 7)) * 2 - 1
+	input_emotions: Tensor = torch.randn((16, 7)).softmax(-1)
+
+	with torch.no_grad():
+		outputs: Tensor = model(representations, input_emotions)
+		expected: Tensor = torch.stack([
+			baseline_forward(model, representation, input_emotion)
+			for representation, input_emotion in zip(representations, input_emotions)
+		])
+
+	torch.testing.assert_close(outputs, expected)
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+import torch
+from torch import Tensor
+
+from emotion_chat_bot.model.emotion_model.EmotionModelKernel import EmotionModelKernel
+from emotion_chat_bot.model.emotion_model.EmotionTransition import EmotionModel, sample_dummy_representations
+
+batch_size: int = 5
+
+
+@pytest.fixture(params=[False, True], ids=["no_bias", "bias"])
+def model(request) -> EmotionModel:
+	torch.manual_seed(0)
+	model = EmotionModel(bias=request.param).eval()
+	if request.param:
+		# a visible bias so that dropping it would fail the comparison
+		torch.nn.init.uniform_(model.state_dict()["_EmotionModel__weight_D.bias"], -0.5, 0.5)
+
+	return model
+
+
+def sample_inputs(shape: str) -> (Tensor, Tensor):
+	generator: torch.Generator = torch.Generator().manual_seed(1)
+	representations: Tensor = sample_dummy_representations(torch.randint(0, 7, (batch_size,)), generator)
+	compositions: Tensor = torch.randn((batch_size, 7), generator=generator).softmax(-1)
+
+	return {
+		"(7,)": (representations[0], compositions[0]),
+		"(1, 7)": (representations[0], compositions[:1]),
+		"(B, 7)": (representations, compositions),
+		"(B, 7, 7)": (
+			representations.unsqueeze(-2).expand(-1, 7, -1),
+			torch.lerp(compositions.unsqueeze(-2).expand(-1, 7, -1), torch.eye(7), 0.5),
+		),
+	}[shape]
+
+
+shapes: list = ["(7,)", "(1, 7)", "(B, 7)", "(B, 7, 7)"]
+
+
+@pytest.mark.parametrize("shape", shapes)
+def test_kernel_matches_model_on_tensors(model: EmotionModel, shape: str) -> None:
+	representation, composition = sample_inputs(shape)
+	kernel: EmotionModelKernel = EmotionModelKernel.from_emotion_model(model)
+
+	with torch.no_grad():
+		expected: Tensor = model(representation, composition)
+	output = kernel(representation, composition)
+
+	assert isinstance(output, Tensor)
+	torch.testing.assert_close(output, expected)
+
+
+@pytest.mark.parametrize("shape", shapes)
+def test_kernel_matches_model_on_arrays(model: EmotionModel, shape: str) -> None:
+	representation, composition = sample_inputs(shape)
+	kernel: EmotionModelKernel = EmotionModelKernel.from_emotion_model(model)
+
+	with torch.no_grad():
+		expected: Tensor = model(representation, composition)
+	output = kernel(representation.numpy(), composition.numpy())
+
+	assert isinstance(output, np.ndarray)
+	np.testing.assert_allclose(output, expected.numpy(), rtol=1e-5, atol=1e-6)
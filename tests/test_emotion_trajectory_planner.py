@@ -0,0 +1,74 @@
+import pytest
+import torch
+from torch import Tensor
+
+from emotion_chat_bot.model.emotion_model.EmotionModelKernel import EmotionModelKernel
+from emotion_chat_bot.model.emotion_model.EmotionTrajectoryPlanner import EmotionTrajectoryPlanner, mirror_reaction
+from emotion_chat_bot.model.emotion_model.EmotionTransition import (
+	EmotionModel,
+	SimilarityAnalyzer,
+	generate_representation,
+)
+
+
+@pytest.fixture
+def model() -> EmotionModel:
+	torch.manual_seed(0)
+
+	return EmotionModel(bias=True).eval()
+
+
+@pytest.fixture
+def inputs() -> (Tensor, Tensor):
+	generator: torch.Generator = torch.Generator().manual_seed(1)
+	representations: Tensor = torch.rand(3, 7, generator=generator) * 2 - 1
+	user_emotion_compositions: Tensor = torch.rand(3, 7, generator=generator).softmax(-1)
+
+	return representations, user_emotion_compositions
+
+
+def step_by_step_rollout(
+	model: EmotionModel, representations: Tensor, user_emotion_compositions: Tensor, horizon: int
+) -> Tensor:
+	future_representations: list = []
+	for representation, composition in zip(representations, user_emotion_compositions):
+		bot_emotion_representations: list = []
+		for bot_emotion in range(7):
+			bot_representation: Tensor = representation
+			user_composition: Tensor = composition
+			for _ in range(horizon):
+				user_composition = mirror_reaction(user_composition.unsqueeze(0))[0, bot_emotion]
+				bot_representation = model.forward(user_composition, bot_representation)
+			bot_emotion_representations.append(bot_representation)
+		future_representations.append(torch.stack(bot_emotion_representations))
+
+	return torch.stack(future_representations)
+
+
+def test_mirror_reaction_depends_on_user_composition() -> None:
+	reactions: Tensor = mirror_reaction(torch.eye(7)[[1, 4]])
+
+	assert reactions.shape == (2, 7, 7)
+	torch.testing.assert_close(reactions.sum(-1), torch.ones(2, 7))
+	assert not torch.equal(reactions[0], reactions[1])
+
+
+@pytest.mark.parametrize("horizon", [1, 2, 3])
+def test_rollout_carries_representations(model: EmotionModel, inputs: (Tensor, Tensor), horizon: int) -> None:
+	representations, user_emotion_compositions = inputs
+	planner = EmotionTrajectoryPlanner(SimilarityAnalyzer(generate_representation(4)), horizon=horizon)
+
+	torch.testing.assert_close(
+		planner.rollout(model, representations, user_emotion_compositions),
+		step_by_step_rollout(model, representations, user_emotion_compositions, horizon),
+	)
+
+
+def test_rollout_with_numpy_kernel(model: EmotionModel, inputs: (Tensor, Tensor)) -> None:
+	representations, user_emotion_compositions = inputs
+	planner = EmotionTrajectoryPlanner(SimilarityAnalyzer(generate_representation(4)), horizon=2)
+
+	torch.testing.assert_close(
+		planner.rollout(EmotionModelKernel.from_emotion_model(model), representations, user_emotion_compositions),
+		planner.rollout(model, representations, user_emotion_compositions),
+	)
@@ -0,0 +1,121 @@
+import asyncio
+import threading
+from typing import Callable, Dict, List, Optional
+
+import pytest
+
+from emotion_chat_bot.service.RequestCoalescer import QueueFullError, RequestCoalescer
+
+
+class BlockingBot:
+	def __init__(self, commit_before_release: bool = False) -> None:
+		self.started: threading.Event = threading.Event()
+		self.release: threading.Event = threading.Event()
+		self.queue_depths: List[int] = []
+		self.committed_messages: List[str] = []
+		self.commit_before_release: bool = commit_before_release
+
+	def chat_batch(
+		self,
+		session_ids: List[str],
+		user_messages: List[str],
+		generation_config,
+		queue_depth: int = 0,
+		should_commit: Optional[Callable[[int], bool]] = None,
+	) -> List[Dict[str, str]]:
+		self.queue_depths.append(queue_depth)
+		if self.commit_before_release:
+			self.commit(user_messages, should_commit)
+		self.started.set()
+		self.release.wait(5)
+		if not self.commit_before_release:
+			self.commit(user_messages, should_commit)
+
+		return [{"emotion": "neutral", "response": message} for message in user_messages]
+
+	def commit(self, user_messages: List[str], should_commit: Optional[Callable[[int], bool]]) -> None:
+		self.committed_messages.extend(
+			message for i, message in enumerate(user_messages) if should_commit is None or should_commit(i)
+		)
+
+
+def test_stop_cancels_in_flight_batch() -> None:
+	async def run() -> None:
+		bot = BlockingBot()
+		coalescer = RequestCoalescer(bot, max_wait_time=0, request_timeout=None)
+		coalescer.start()
+
+		request: asyncio.Task = asyncio.create_task(coalescer.submit("session", "Hi."))
+		await asyncio.get_running_loop().run_in_executor(None, bot.started.wait, 5)
+
+		await coalescer.stop()
+		bot.release.set()
+		with pytest.raises(asyncio.CancelledError):
+			await asyncio.wait_for(request, 1)
+
+	asyncio.run(run())
+
+
+def test_deferred_requests_count_against_capacity() -> None:
+	async def run() -> None:
+		bot = BlockingBot()
+		coalescer = RequestCoalescer(bot, max_wait_time=0.05, max_queue_size=3, request_timeout=None)
+		coalescer.start()
+
+		# later messages of a session are deferred while the first one is in flight
+		requests: list = [asyncio.create_task(coalescer.submit("session", f"{i}.")) for i in range(3)]
+		await asyncio.get_running_loop().run_in_executor(None, bot.started.wait, 5)
+		assert coalescer.queue_depth == 2
+		# the backlog at dispatch is handed to the bot for load-aware scoring
+		assert bot.queue_depths == [2]
+
+		requests.append(asyncio.create_task(coalescer.submit("other session", "3.")))
+		await asyncio.sleep(0)
+		assert coalescer.queue_depth == 3
+		with pytest.raises(QueueFullError):
+			await coalescer.submit("another session", "Hi.")
+
+		bot.release.set()
+		results: list = await asyncio.gather(*requests)
+		assert sorted(result["response"] for result in results) == ["0.", "1.", "2.", "3."]
+		await coalescer.stop()
+
+	asyncio.run(run())
+
+
+def test_timed_out_request_is_not_committed() -> None:
+	async def run() -> None:
+		bot = BlockingBot()
+		coalescer = RequestCoalescer(bot, max_wait_time=0, request_timeout=0.05)
+		coalescer.start()
+
+		with pytest.raises(asyncio.TimeoutError):
+			await coalescer.submit("session", "Hi.")
+		bot.release.set()
+
+		# the retry is the only copy of the message that gets stored
+		bot.started.clear()
+		assert (await coalescer.submit("session", "Hi."))["response"] == "Hi."
+		assert bot.committed_messages == ["Hi."]
+		await coalescer.stop()
+
+	asyncio.run(run())
+
+
+def test_committed_request_outlives_timeout() -> None:
+	async def run() -> None:
+		bot = BlockingBot(commit_before_release=True)
+		coalescer = RequestCoalescer(bot, max_wait_time=0, request_timeout=0.05)
+		coalescer.start()
+
+		request: asyncio.Task = asyncio.create_task(coalescer.submit("session", "Hi."))
+		await asyncio.get_running_loop().run_in_executor(None, bot.started.wait, 5)
+		await asyncio.sleep(0.1)
+		assert not request.done()
+
+		bot.release.set()
+		assert (await request)["response"] == "Hi."
+		assert bot.committed_messages == ["Hi."]
+		await coalescer.stop()
+
+	asyncio.run(run())
@@ -0,0 +1,78 @@
+from typing import Any, Callable, Dict, List
+
+import pytest
+from transformers import GenerationConfig
+
+from emotion_chat_bot.pipeline.ResponseGenerationPipeline import ResponseGeneratorPipeline
+
+chat: List[Dict[str, Any]] = [
+	{"role": "system", "content": {"emotion": "", "dialog": "You are a friendly chat bot."}},
+	{"role": "user", "content": {"emotion": "anger", "dialog": "Why are you so slow?"}},
+	{"role": "bot", "content": {"emotion": "sadness", "dialog": "Sorry, I am doing my best."}},
+	{"role": "user", "content": {"emotion": "surprise", "dialog": "Oh, thanks!"}},
+]
+
+
+def incremental_prompt_ids(pipeline: ResponseGeneratorPipeline, emotion: str) -> List[int]:
+	return [
+		token_id
+		for i, message in enumerate(chat[1:])
+		for token_id in pipeline.tokenize_message(message, chat[0] if i == 0 else None)
+	] + pipeline.generation_prompt_ids(emotion)
+
+
+@pytest.mark.parametrize("legacy", [False, True])
+def test_incremental_tokenization_support_matches_full_tokenization(
+	response_generator_factory: Callable[..., ResponseGeneratorPipeline], legacy: bool
+) -> None:
+	pipeline: ResponseGeneratorPipeline = response_generator_factory(legacy)
+
+	matches: bool = all(
+		incremental_prompt_ids(pipeline, emotion)
+		== pipeline.tokenize_chat(
+			chat + [{"role": "bot", "content": {"emotion": emotion, "dialog": ""}}], add_generation_prompt=True
+		)
+		for emotion in ["neutral", "happiness", "surprise"]
+	)
+
+	assert pipeline.supports_incremental_tokenization == matches
+
+
+def test_sft_template_falls_back_when_boundaries_merge(
+	response_generator_factory: Callable[..., ResponseGeneratorPipeline],
+) -> None:
+	# the sft template opens the bot message with plain text, which a leading space tokenizer encodes differently
+	assert not response_generator_factory(legacy=True).supports_incremental_tokenization
+	assert response_generator_factory(legacy=False).supports_incremental_tokenization
+
+
+def test_shared_prefix_generation_matches_generation_from_ids(
+	response_generator_factory: Callable[..., ResponseGeneratorPipeline],
+) -> None:
+	pipeline: ResponseGeneratorPipeline = response_generator_factory()
+	generation_config = GenerationConfig(
+		max_new_tokens=6,
+		min_new_tokens=6,
+		do_sample=False,
+		pad_token_id=pipeline.tokenizer.pad_token_id,
+		eos_token_id=pipeline.tokenizer.eos_token_id,
+	)
+	chats: List[List[Dict[str, Any]]] = [chat, chat[:2]]
+	candidates_ids: List[List[List[int]]] = [
+		[
+			pipeline.tokenize_chat(
+				chat + [{"role": "bot", "content": {"emotion": emotion, "dialog": ""}}], add_generation_prompt=True
+			)
+			for emotion in chat_emotions
+		]
+		for chat, chat_emotions in zip(chats, [["neutral", "happiness", "surprise"], ["anger", "fear"]])
+	]
+
+	shared_prefix_responses: List[List[str]] = pipeline.generate_from_shared_prefix_ids(
+		candidates_ids, generation_config
+	)
+	responses: List[str] = pipeline.generate_from_ids(
+		[ids for candidate_ids in candidates_ids for ids in candidate_ids], generation_config
+	)
+
+	assert [response for chat_responses in shared_prefix_responses for response in chat_responses] == responses
@@ -0,0 +1,15 @@
+import pytest
+from transformers import GenerationConfig
+
+from emotion_chat_bot.utils.RetryPolicy import RetryPolicy
+
+
+@pytest.mark.parametrize("repetition_penalty, expected", [(None, 1.2), (1.5, 1.7)])
+def test_escalate_repetition_penalty(repetition_penalty, expected: float) -> None:
+	generation_config = GenerationConfig(repetition_penalty=repetition_penalty)
+
+	escalated_generation_config: GenerationConfig = RetryPolicy().escalate(generation_config, 2)
+
+	assert escalated_generation_config.do_sample
+	assert escalated_generation_config.repetition_penalty == pytest.approx(expected)
+	assert generation_config.repetition_penalty == repetition_penalty
@@ -0,0 +1,126 @@
+import sqlite3
+import threading
+from pathlib import Path
+
+import pytest
+
+from emotion_chat_bot.session.ChatHistory import ChatHistory, Turn
+from emotion_chat_bot.session.ChatSession import ChatSession
+from emotion_chat_bot.session.SessionStore import SQLiteSessionStore, schema_version
+
+
+def create_session(dialog: str) -> ChatSession:
+	history = ChatHistory(4)
+	history.append(Turn.from_message("user", "neutral", dialog))
+
+	return ChatSession(history=history, summary="summary")
+
+
+def test_flush_writes_the_session_as_put(tmp_path: Path) -> None:
+	store = SQLiteSessionStore(str(tmp_path / "sessions.db"), flush_interval=None)
+	session: ChatSession = create_session("Hi.")
+	store.put("a", session)
+	# changes after put belong to the next turn and must not leak into this flush
+	session.history.append(Turn.from_message("bot", "happiness", "Hello!"))
+	store.close()
+
+	store = SQLiteSessionStore(str(tmp_path / "sessions.db"), flush_interval=None)
+	loaded_session: ChatSession = store.get("a")
+	store.close()
+
+	assert [turn.dialog for turn in loaded_session.history] == ["Hi."]
+	assert loaded_session.summary == "summary"
+	assert loaded_session.emotion_representation.tolist() == session.emotion_representation.tolist()
+
+
+def test_evicted_sessions_are_written(tmp_path: Path) -> None:
+	store = SQLiteSessionStore(str(tmp_path / "sessions.db"), max_cached_sessions=1, flush_interval=None)
+	store.put("a", create_session("first"))
+	store.put("b", create_session("second"))
+
+	assert [turn.dialog for turn in store.get("a").history] == ["first"]
+	store.close()
+
+
+def test_eviction_during_flush_keeps_the_newer_session(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+	store = SQLiteSessionStore(str(tmp_path / "sessions.db"), max_cached_sessions=1, flush_interval=None)
+	store.put("a", create_session("old"))
+	write = store._SQLiteSessionStore__write
+
+	def put_newer_and_evict() -> None:
+		store.put("a", create_session("new"))
+		store.put("b", create_session("other"))
+
+	thread = threading.Thread(target=put_newer_and_evict)
+
+	def write_with_interleaved_eviction(rows: list) -> None:
+		monkeypatch.setattr(store, "_SQLiteSessionStore__write", write)
+		# the other thread gets a chance to evict the newer row before the flush writes the older one
+		thread.start()
+		thread.join(0.2)
+		write(rows)
+
+	monkeypatch.setattr(store, "_SQLiteSessionStore__write", write_with_interleaved_eviction)
+	store.flush()
+	thread.join()
+	store.close()
+
+	store = SQLiteSessionStore(str(tmp_path / "sessions.db"), flush_interval=None)
+	assert [turn.dialog for turn in store.get("a").history] == ["new"]
+	store.close()
+
+
+def test_schema_version(tmp_path: Path) -> None:
+	path: str = str(tmp_path / "sessions.db")
+	SQLiteSessionStore(path, flush_interval=None).close()
+
+	connection = sqlite3.connect(path)
+	assert connection.execute("PRAGMA user_version").fetchone()[0] == schema_version
+	connection.execute(f"PRAGMA user_version = {schema_version + 1}")
+	connection.commit()
+	connection.close()
+
+	with pytest.raises(ValueError):
+		SQLiteSessionStore(path, flush_interval=None)
+
+
+def test_pending_summary_turns_are_written(tmp_path: Path) -> None:
+	store = SQLiteSessionStore(str(tmp_path / "sessions.db"), flush_interval=None)
+	session: ChatSession = create_session("Hi.")
+	session.summarizing_turns = [Turn.from_message("user", "anger", "first")]
+	session.evicted_turns = [Turn.from_message("bot", "neutral", "second")]
+	store.put("a", session)
+	store.close()
+
+	store = SQLiteSessionStore(str(tmp_path / "sessions.db"), flush_interval=None)
+	loaded_session: ChatSession = store.get("a")
+	store.close()
+
+	assert [turn.dialog for turn in loaded_session.evicted_turns] == ["first", "second"]
+	assert loaded_session.summarizing_turns == []
+
+
+def test_unversioned_database_is_migrated(tmp_path: Path) -> None:
+	path: str = str(tmp_path / "sessions.db")
+	connection = sqlite3.connect(path)
+	connection.execute(
+		"CREATE TABLE sessions ("
+		"session_id TEXT PRIMARY KEY, "
+		"history TEXT NOT NULL, "
+		"summary TEXT NOT NULL, "
+		"emotion_representation BLOB NOT NULL, "
+		"bot_emotion_representation BLOB)"
+	)
+	connection.execute(
+		"INSERT INTO sessions VALUES (?, ?, ?, ?, ?)",
+		("a", '{"capacity": 4, "turns": [[0, 0, "Hi.", null]]}', "", bytes(28), None),
+	)
+	connection.commit()
+	connection.close()
+
+	store = SQLiteSessionStore(path, flush_interval=None)
+	session: ChatSession = store.get("a")
+	store.close()
+
+	assert [turn.dialog for turn in session.history] == ["Hi."]
+	assert session.evicted_turns == []
@@ -0,0 +1,51 @@
+from typing import List
+
+import pytest
+import torch
+from torch import Tensor
+
+from emotion_chat_bot.model.emotion_model.EmotionTransition import (
+	MultiPersonaSimilarityAnalyzer,
+	SimilarityAnalyzer,
+	generate_representation,
+)
+
+
+@pytest.fixture
+def analyzers() -> List[SimilarityAnalyzer]:
+	generator: torch.Generator = torch.Generator().manual_seed(0)
+
+	return [
+		SimilarityAnalyzer(generate_representation(emotion, generator), threshold=threshold)
+		for emotion, threshold in zip(range(7), [0.3, 0.5, 0.7, 0.9, 0.6, 0.4, 0.8])
+	]
+
+
+@pytest.fixture
+def representations() -> Tensor:
+	generator: torch.Generator = torch.Generator().manual_seed(1)
+	# a wide spread of lengths so that scores land on both sides of the thresholds
+	return torch.rand(16, 7, generator=generator) * 2 - 1
+
+
+def test_single_persona_matches_similarity_analyzer(
+	analyzers: List[SimilarityAnalyzer], representations: Tensor
+) -> None:
+	for analyzer in analyzers:
+		multi_persona_analyzer = MultiPersonaSimilarityAnalyzer(
+			analyzer.ideal_emotion_representation.unsqueeze(0), analyzer.threshold
+		)
+
+		torch.testing.assert_close(multi_persona_analyzer(representations.unsqueeze(0))[0], analyzer(representations))
+
+
+def test_persona_indices_match_similarity_analyzers(
+	analyzers: List[SimilarityAnalyzer], representations: Tensor
+) -> None:
+	multi_persona_analyzer = MultiPersonaSimilarityAnalyzer.from_similarity_analyzers(analyzers)
+	persona_indices: Tensor = torch.tensor([3, 0, 6, 3])
+
+	scores: Tensor = multi_persona_analyzer(representations.expand(4, -1, -1), persona_indices)
+
+	for row, persona_index in enumerate(persona_indices.tolist()):
+		torch.testing.assert_close(scores[row], analyzers[persona_index](representations))